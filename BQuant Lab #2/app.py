@@ -5,7 +5,8 @@ import logging
 from bqplot import OrdinalScale, ColorScale, GridHeatMap, Tooltip, Axis, ColorAxis, Figure
 from bqwidgets import TickerAutoComplete
 from model import DataModel
-from logwidget import LogWidget, LogWidgetAdapter, LogWidgetHandler
+import timing
+from logwidget import LogWidget, LogWidgetAdapter, LogWidgetHandler, LogPipeline, rotating_file_handler
 
 # Widget to display the logs
 _log_widget = LogWidget(
@@ -16,9 +17,22 @@ _handler = LogWidgetHandler(_log_widget)
 _formatter = logging.Formatter('%(asctime)s - %(message)s', '%H:%M:%S')
 _handler.setFormatter(_formatter)
 
-# Define app logger and add widget handler
+# Handlers are fed from a queue by a listener thread, so that logging never
+# waits on the widget or on the disk. Structured logs also go to a file.
+_handlers = [_handler]
+try:
+    _handlers.append(rotating_file_handler('heatmap_app.log'))
+except Exception:
+    pass
+_log_pipeline = LogPipeline(_handlers)
+_log_pipeline.start()
+
+# Timings of each Run, summarized in the log widget and in a JSON file
+timing.enable(log_path='run_timings.jsonl')
+
+# Define app logger and add the queue handler
 _logger = logging.getLogger('HeatmapApp')
-_logger.addHandler(_handler)
+_log_pipeline.attach(_logger)
 _logger.setLevel(logging.DEBUG)
 
 
@@ -76,6 +90,17 @@ class HeatmapApp(object):
 
     def _refresh_data(self, *args, **kwargs):
         """Called upon button Run is clicked."""
+        # collect the timings of this run, even if it fails
+        timing.start_run('Run')
+        try:
+            self._run_steps()
+        finally:
+            # where the time went: log widget and run_timings.jsonl
+            timing.end_run(_logger)
+
+
+    def _run_steps(self):
+        """Steps of a Run, timed by `_refresh_data`."""
         # disable the selectable objects while running
         self.button_run.disabled = True
 
@@ -143,6 +168,7 @@ class HeatmapApp(object):
             self.matrix_tooltip.children = [ipywidgets.HTML('<p style="font-weight:italic; color:dimgrey;">No data fetched.</p>')]
 
 
+    @timing.timed('app.build_matrix')
     def _build_matrix(self):
 
         # retrieve the data to be displayed
@@ -159,6 +185,7 @@ class HeatmapApp(object):
         self.widgets['main_box'].layout.height = '{}px'.format(len(self.data)*15) if len(self.data)*15 > 400 else '400px'
 
 
+    @timing.timed('app.build_heatmap')
     def _build_heatmap(self, df):
         # create the matrix 
         x_sc, y_sc, col_sc = OrdinalScale(), OrdinalScale(reverse=True), ColorScale(scheme='RdYlGr')
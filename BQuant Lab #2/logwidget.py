@@ -3,6 +3,12 @@ import datetime as dt
 from IPython.display import display
 from ipywidgets import HTML
 import logging
+import logging.handlers
+import copy
+import json
+import queue
+import threading
+import time
 
 
 class LogWidgetAdapter(logging.LoggerAdapter):
@@ -48,9 +54,23 @@ class LogWidgetHandler(logging.Handler):
 
 
 class LogWidget(object):
-    def __init__(self, max_msgs=20, layout=None):
+    """
+    Console of the last `max_msgs` messages.
+    Messages are buffered and the widget is rendered by a background timer,
+    at most once every `flush_interval` seconds, so that a burst of logs costs
+    one update of the widget. Set `flush_interval` to 0 to render each message
+    as it comes. Safe to call from any thread.
+    """
+    def __init__(self, max_msgs=20, layout=None, flush_interval=0.25):
         self.widgets = dict()
         self.msg_queue = deque(maxlen=max_msgs)
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()        # protects the queue and the timer
+        self._flush_lock = threading.Lock()  # keeps the renders in order
+        self._timer = None
+        self._pending = False
+        self._last_flush = 0.
 
         default_layout = {
             'display': 'flex',
@@ -66,11 +86,33 @@ class LogWidget(object):
             msg_color_temp = """<font color="{font_color}">{user_msg}</font>"""
             msg = msg_color_temp.format(font_color=str(color), user_msg=msg)
 
-        self.msg_queue.appendleft(msg)
-        self._update()
-
-    def _update(self):
-        html_string = '<br>'.join(list(self.msg_queue))
+        with self._lock:
+            self.msg_queue.appendleft(msg)
+            self._pending = True
+            if self.flush_interval and self._timer is None:
+                # render once the interval since the last render has elapsed
+                delay = max(self._last_flush + self.flush_interval - time.monotonic(), 0)
+                self._timer = threading.Timer(delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if not self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Render the messages received since the last render, if any."""
+        with self._flush_lock:
+            with self._lock:
+                self._timer = None
+                if not self._pending:
+                    return
+                self._pending = False
+                self._last_flush = time.monotonic()
+                msgs = list(self.msg_queue)
+            self._update(msgs)
+
+    def _update(self, msgs):
+        html_string = '<br>'.join(msgs)
         html_string = '<div style="margin: 3px;">{}</div>'.format(html_string)
         self.widgets['html_console'].value = html_string
 
@@ -80,3 +122,107 @@ class LogWidget(object):
 
     def display_widget(self):
         display(self.widgets['html_console'])
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Put the records in a bounded queue without ever blocking the caller.
+    When the queue is full, `policy` decides which record is lost: the new
+    one ('drop_new') or the oldest one waiting ('drop_oldest'). Lost records
+    are counted in `dropped`.
+    """
+    def __init__(self, log_queue, policy='drop_new'):
+        super().__init__(log_queue)
+        self.policy = policy
+        self.dropped = 0
+        self._drop_lock = threading.Lock()
+
+    def prepare(self, record):
+        """Same as QueueHandler.prepare (message merged with its arguments,
+        exc_info dropped), but the traceback is kept apart in exc_text rather
+        than appended to the message, so that each handler formats it."""
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.policy == 'drop_oldest':
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    pass
+            with self._drop_lock:
+                self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, for the log files."""
+    def format(self, record):
+        entry = {
+            'time': dt.datetime.fromtimestamp(record.created).isoformat(),
+            'logger': record.name,
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        # the traceback arrives formatted in exc_text from BoundedQueueHandler
+        exception = self.formatException(record.exc_info) if record.exc_info else record.exc_text
+        if exception:
+            entry['exception'] = exception
+        return json.dumps(entry)
+
+
+def rotating_file_handler(path, max_bytes=5 * 1024 * 1024, backup_count=3):
+    """Handler writing JSON lines to `path`, rotated every `max_bytes`."""
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+class LogPipeline(object):
+    """
+    Non-blocking logging: the loggers only put records in a bounded queue, and
+    a listener thread hands them to the actual handlers (the log widget, log
+    files...). A slow handler can then never stall the thread that logs.
+    Parameters
+    ----------
+    handlers: list
+        handlers fed by the listener
+    maxsize: int
+        records kept waiting at most
+    policy: str
+        'drop_new' or 'drop_oldest', when the queue is full
+    """
+    def __init__(self, handlers, maxsize=1000, policy='drop_new'):
+        self.queue = queue.Queue(maxsize)
+        self.handler = BoundedQueueHandler(self.queue, policy)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self._started = False
+
+    @property
+    def dropped(self):
+        """Number of records lost because the queue was full."""
+        return self.handler.dropped
+
+    def attach(self, logger):
+        """Send the records of `logger` through the pipeline."""
+        logger.addHandler(self.handler)
+
+    def start(self):
+        if not self._started:
+            self.listener.start()
+            self._started = True
+
+    def stop(self):
+        """Process the records waiting, then stop the listener."""
+        if self._started:
+            self.listener.stop()
+            self._started = False
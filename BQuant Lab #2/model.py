@@ -2,6 +2,7 @@ import pandas as pd
 import logging
 
 import bql
+import timing
 
 _logger = logging.getLogger('HeatmapApp')
 
@@ -36,6 +37,7 @@ class DataModel(object):
             self._bq = DataModel.__shared_bq__
             
         
+    @timing.timed('model.run', measure=lambda result, self: self.data)
     def run(self):
         """Run the model"""
 
@@ -52,6 +54,7 @@ class DataModel(object):
         self.data = self._yield_raw_df(raw_data, self._asset_class)
             
     
+    @timing.timed('model.get_data')
     def _get_data(self, query):
         """
         Retrieve data model based on the universe and the BQL items
@@ -131,6 +134,7 @@ class DataModel(object):
         return df
     
     
+    @timing.timed('model.build_2dim_dataset')
     def build_2dim_dataset(self, df, x='Month', y='Year', v='Amount Out', calc_type='sum'):
         '''
         Summary: returns a table in 2-dim with data transformed and 
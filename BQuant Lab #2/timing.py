@@ -0,0 +1,231 @@
+"""
+Lightweight timers for the hot paths of a Run.
+
+    with timing.span('app.build_tables') as s:
+        ...
+        s.measure(df)                  # rows and bytes of what was produced
+
+    @timing.timed('model.get_data')    # rows and bytes of the returned value
+    def _get_data(self, ...):
+
+Spans record their wall time, and optionally a number of rows and bytes.
+Each run keeps its own records: `start_run` makes the run current in the
+calling context (thread or asyncio task), spans opened in that context are
+recorded in it, and `end_run` aggregates them into a summary which is logged
+and appended as one JSON line to a file. Work handed to another thread joins
+the run through `bind`; spans opened outside of any run are not recorded.
+Timing is off until `enable` is called; disabled spans cost a flag check.
+"""
+import json
+import time
+import datetime
+import functools
+import threading
+import contextvars
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+_enabled = False
+_log_path = None
+
+# run collecting the spans, and names of the spans open, in the current context
+_current_run = contextvars.ContextVar('timing_run', default=None)
+_stack = contextvars.ContextVar('timing_stack', default=())
+
+
+def enable(log_path=None):
+    """Start recording spans. Run summaries are appended to `log_path` (JSON lines) if set."""
+    global _enabled, _log_path
+    _enabled, _log_path = True, log_path
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def size_of(obj):
+    """Rows and bytes of a DataFrame, Series or array (first item of a tuple).
+    The bytes of object columns include the strings they point to."""
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    if isinstance(obj, pd.DataFrame):
+        return len(obj), int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return len(obj), int(obj.memory_usage(index=True, deep=True))
+    if isinstance(obj, np.ndarray):
+        return len(obj), int(obj.nbytes)
+    return None, None
+
+
+class Run(object):
+    """Spans recorded between `start_run` and `end_run`."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+
+class _Span(object):
+    __slots__ = ('name', 'parent', 'start', 'rows', 'bytes', 'run', 'token')
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.bytes = None
+
+    def measure(self, obj):
+        """Record the rows and bytes of `obj` (see `size_of`)."""
+        self.rows, self.bytes = size_of(obj)
+
+    def __enter__(self):
+        self.run = _current_run.get()
+        stack = _stack.get()
+        self.parent = stack[-1] if stack else None
+        self.token = _stack.set(stack + (self.name,))
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        _stack.reset(self.token)
+        if self.run is not None:
+            self.run.add((self.name, self.parent, seconds, self.rows, self.bytes))
+        return False
+
+
+class _NullSpan(object):
+    def measure(self, obj):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name):
+    """Context manager timing the block it wraps."""
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def timed(name, measure=None):
+    """
+    Decorator timing each call of the function.
+    Parameters
+    ----------
+    name: str
+        name of the span
+    measure: callable
+        optional, called as measure(result, *args, **kwargs) and returning the
+        object to size. By default the returned value is sized.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name) as s:
+                result = func(*args, **kwargs)
+                s.measure(result if measure is None else measure(result, *args, **kwargs))
+            return result
+        return wrapper
+    return decorator
+
+
+def bind(func):
+    """Wrap `func` to run in a copy of the current context, so that its spans
+    join the current run when it is called on another thread (eg. executor)."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def start_run(name):
+    """
+    Start collecting the spans of a run, in the current context (thread or
+    asyncio task) and in the functions bound to it afterwards.
+    Returns : the Run, or None if timing is disabled
+    """
+    if not _enabled:
+        return None
+    run = Run(name)
+    _current_run.set(run)
+    return run
+
+
+def end_run(logger=None):
+    """
+    Close the run of the current context and aggregate its spans by name.
+    The summary is logged on `logger` (if given) and appended to the log file.
+    Returns : the summary (dict), or None if no run was started
+    """
+    run = _current_run.get()
+    if run is None:
+        return None
+    _current_run.set(None)
+    with run._lock:
+        records = list(run.records)
+
+    spans = OrderedDict()
+    for name, parent, seconds, rows, nbytes in records:
+        s = spans.setdefault(name, {'name': name, 'parent': parent, 'calls': 0, 'seconds': 0.,
+                                    'rows': None, 'bytes': None})
+        s['calls'] += 1
+        s['seconds'] += seconds
+        if rows is not None:
+            s['rows'] = (s['rows'] or 0) + rows
+        if nbytes is not None:
+            s['bytes'] = (s['bytes'] or 0) + nbytes
+
+    summary = {'run': run.name, 'started': run.started,
+               'seconds': time.perf_counter() - run.start, 'spans': list(spans.values())}
+
+    if logger is not None:
+        logger.info('Timings of {} ({:.2f}s): {}'.format(summary['run'], summary['seconds'], format_spans(summary['spans'])))
+
+    if _log_path is not None:
+        try:
+            with open(_log_path, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+        except Exception as e:
+            if logger is not None:
+                logger.warning('Timings of {} not written to {} ({})'.format(summary['run'], _log_path, e))
+
+    return summary
+
+
+def format_spans(spans):
+    """One-line description of the spans, the slowest first."""
+    items = []
+    for s in sorted(spans, key=lambda s: -s['seconds']):
+        details = ['{:.2f}s'.format(s['seconds'])]
+        if s['calls'] > 1:
+            details.append('x{}'.format(s['calls']))
+        if s['rows'] is not None:
+            details.append('{:,} rows'.format(s['rows']))
+        if s['bytes'] is not None:
+            details.append('{:.1f}MB'.format(s['bytes'] / 1e6))
+        items.append('{} {}'.format(s['name'], ' '.join(details)))
+    return ' | '.join(items)
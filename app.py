@@ -6,14 +6,21 @@ import logging
 import bqport
 
 from bqplot import LinearScale, OrdinalScale, ColorScale, DateScale, GridHeatMap, Scatter, Tooltip, Lines, Bars, Axis, ColorAxis, Figure
-from bqplot.interacts import BrushSelector, IndexSelector
+from bqplot.interacts import BrushSelector, IndexSelector, PanZoom
 
 from bqwidgets import DataGrid, TickerAutoComplete
 from IPython.display import display
-from model import PortfolioMonitorModel
-from logwidget import LogWidget, LogWidgetAdapter, LogWidgetHandler
-from collections import OrderedDict
+from model import PortfolioMonitorModel, RunCancelled
+from timeseries import downsample_minmax
+from tableview import TableView, CategoryIndex
+import workbook
+import timing
+from logwidget import LogWidget, LogWidgetAdapter, LogWidgetHandler, LogPipeline, rotating_file_handler
+from collections import OrderedDict, deque
 import datetime
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 
 # Widget to display the logs
@@ -25,18 +32,67 @@ _handler = LogWidgetHandler(_log_widget)
 _formatter = logging.Formatter('%(asctime)s - %(message)s', '%H:%M:%S')
 _handler.setFormatter(_formatter)
 
-# Define app logger and add widget handler
+# Handlers are fed from a queue by a listener thread, so that logging never
+# waits on the widget or on the disk. Structured logs also go to a file.
+_handlers = [_handler]
+try:
+    _handlers.append(rotating_file_handler('portfolio_monitor.log'))
+except Exception:
+    pass
+_log_pipeline = LogPipeline(_handlers)
+_log_pipeline.start()
+
+# Define app logger and add the queue handler
 _logger = logging.getLogger('PortfolioMonitorDemo')
-_logger.addHandler(_handler)
+_log_pipeline.attach(_logger)
 _logger.setLevel(logging.DEBUG)
 
+# Timings of the Run pipeline, summarized in the log widget and in a JSON file
+timing.enable(log_path='run_timings.jsonl')
+
+# Worker thread running the model (one run at a time)
+_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def _running_loop():
+    """The event loop running in this thread (the kernel's), or None."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _schedule(coro):
+    """Run `coro` on the kernel event loop, or until completion if no loop is running."""
+    loop = _running_loop()
+    if loop is not None:
+        return loop.create_task(coro)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
 
 class PortfolioMonitorDemo(object):
+    # Rows of the Data table sent to the grid at once (one page)
+    __grid_page_size__ = 200
+
+    # Scatter tooltip: minimum time between two updates (seconds), and
+    # columns not displayed
+    __hover_interval__ = 0.05
+    __tooltip_exclusions__ = ('index', 'Year to mat', 'US 10y T', 'intRating')
+
+    # Resolution of the Relative valuation chart: points per series (about
+    # the chart width in pixels) and maximum points sent for all the series
+    __chart_width__ = 1000
+    __chart_max_points__ = 40000
+
     def __init__(self):
         self._load_default_settings()
 
     def _load_default_settings(self):
-        config_file = pd.read_excel('config.xlsx', sheetname='controls')
+        config_file = workbook.read_sheet('config.xlsx', 'controls')
 
         columns = ['field_name','control_name','value_type','default']
         # build one dataframe per tab config
@@ -48,7 +104,7 @@ class PortfolioMonitorDemo(object):
         self._activate_custom_list = self.app_config[self.app_config.control_name == 'custom-list']['default'].values[0]
         self._activate_settings_tab = self.app_config[self.app_config.control_name == 'settings-tab']['default'].values[0]
 
-        _logger.info('Default settings loaded.')
+        _logger.info('Default settings loaded ({:.2f}s spent parsing workbooks).'.format(workbook.get_total_load_time()))
 
 
     def show(self):
@@ -65,54 +121,172 @@ class PortfolioMonitorDemo(object):
 
 
     def _run(self, *args, **kwargs):
-        """Called upon button Run is clicked."""
+        """Called upon button Run is clicked.
+        The model runs on a worker thread; the tabs are built back on the
+        kernel thread once the data is ready (see `_run_pipeline`)."""
+        # Retrieve user input to calibrate the Model
+        # inputs for model: universe_type, universe_value, asset
+        universe_type = self.univ_picker._dropdown_type.value
+        universe_value = self.univ_picker._dropdown_port.value if universe_type == 'Portfolio' \
+                            else self.univ_picker._ac_index.value if universe_type == 'Index'  \
+                            else self.univ_picker._txt_custom.value if universe_type == 'List' else None
+
+        # checked before anything changes: the buttons and tabs are left as they are
+        if not universe_value:
+            _logger.error('Universe seems undefined. Please retry.')
+            return 0
+
         # disable the selectable objects while running
         self._button_run.disabled = True
+        self._button_refresh.disabled = True
 
         # clear any content in the tabs
         self._tab1_box.children = []
         self._tab2_box.children = []
 
-        # Retrieve user input to calibrate the Model
-        # inputs for model: universe_type, universe_value, asset
-        universe_type = self.univ_picker._dropdown_type.value
-        universe_value = self.univ_picker._dropdown_port.value if universe_type == 'Portfolio' \
-                            else self.univ_picker._ac_index.value if universe_type == 'Index'  \
-                            else self.univ_picker._txt_custom.value if universe_type == 'List' else None
         # loading the current config (fields only)
         fields_selected = self._read_from_settings()
         unique_fields_selected = list(set(fields_selected))
 
         # load and run the Model with the user inputs
-        if not universe_value:
-            _logger.error('Universe seems undefined. Please retry.')
-            self._button_run.disabled = False
-            return 0
         # for better display in logger
         display_value_in_logger = '{} bonds'.format(len(universe_value.split('\n'))) if universe_type == 'List' else universe_value
         _logger.info('Loading the data Model... ({}: {})'.format(universe_type, display_value_in_logger))
         self._model = PortfolioMonitorModel(universe_type, universe_value, 'Fixed Income', unique_fields_selected)
-        self._model.run()
-        
+
+        self._button_cancel.disabled = False
+        self._run_task = _schedule(self._run_pipeline(self._model))
+
+
+    async def _run_pipeline(self, model):
+        """Fetch and prepare the data off the kernel thread, then build the tabs.
+        The timings of the run are collected by this task (and the work it
+        hands to the worker) only, from the fetch to the tabs built."""
+        timing.start_run('Run')
+        try:
+            with timing.span('app.run'):
+                await self._run_steps(model)
+        finally:
+            # where the time went: log widget and run_timings.jsonl
+            timing.end_run(_logger)
+
+
+    async def _run_steps(self, model):
+        """Steps of a Run, timed by `_run_pipeline`."""
+        prepared = None
+        try:
+            loop = asyncio.get_running_loop()
+            prepared = await loop.run_in_executor(_executor, timing.bind(self._fetch_and_prepare), model)
+        except RunCancelled:
+            _logger.warn('Run cancelled.')
+        except Exception as e:
+            _logger.error('Run failed ({})'.format(e))
+
+        # a newer run may have replaced this model in the meantime
+        if model is not self._model:
+            return
+
         # checking if some necessary fields are retrieved
         # before proceeding to the display of tables
-        mandatory_fields = self.matrix_tab_scatter_x
-        if not self._model.get_model_data().columns.isin(mandatory_fields).any():
+        if prepared is None:
+            pass
+        elif prepared is False:
             _logger.warn('Some fields are missing and need to be defined first.')
         else:
             _logger.info('Brushing up tables and charts (1)...')
             self._build_matrix()
             _logger.info('Brushing up tables and charts (2)...')
-            self._build_tables()
+            self._build_tables(prepared)
             _logger.info('Brushing up tables and charts (3)...')
             self._build_model_portfolio()
             _logger.info('Job done.')
-        
+            self._button_refresh.disabled = False
+
         # re-enable the selectable objects
+        self._button_cancel.disabled = True
         self._button_run.disabled = False
         self._main_tab.selected_index = 0
+
+
+    def _refresh(self, *args, **kwargs):
+        """Called upon button Refresh is clicked: update the market data of the
+        current universe and patch the tabs rather than building them again."""
+        self._button_run.disabled = True
+        self._button_refresh.disabled = True
+        self._button_cancel.disabled = False
+        # cleared here rather than on the worker, where the job may wait in the queue
+        self._model.reset_cancel()
+        self._run_task = _schedule(self._refresh_pipeline(self._model))
+
+
+    async def _refresh_pipeline(self, model):
+        changed = []
+        try:
+            loop = asyncio.get_running_loop()
+            data, changed = await loop.run_in_executor(_executor, model.refresh)
+        except RunCancelled:
+            _logger.warn('Refresh cancelled.')
+        except Exception as e:
+            _logger.error('Refresh failed ({})'.format(e))
+
+        # the new data is swapped in here, on the kernel thread where the
+        # matrix dropdowns read it
+        if model is self._model and changed:
+            model.apply_refresh(data, changed)
+            self._patch_views(changed)
+            _logger.info('Job done.')
+
+        self._button_cancel.disabled = True
+        self._button_run.disabled = False
+        self._button_refresh.disabled = False
+
+
+    def _patch_views(self, changed):
+        """Push the columns `changed` by a refresh to the existing widgets."""
+        # Matrix tab: only if the displayed matrix is built on a changed column
+        if self._drop_x.value in changed or self._drop_y.value in changed:
+            self._update_matrix_change(None)
+
+        # Data table tab: the table data follows the order of the model data
+        data = self._model.get_model_data()
+        columns = [c for c in changed if c in self._df_all]
+        for c in columns:
+            self._df_all[c] = data[c].round(1).values
+        self._table.update_columns(self._df_all, columns)
+
+        # same rows displayed: the filters and the lasso selection are kept,
+        # only the values shown by the grid, the scatter and the reg line change
+        try:
+            self._update_grid(start=self._grid_start, count=self._grid_count)
+            self._refresh_scatter_data()
+            self._update_regression_line()
+        except Exception as e:
+            _logger.warn('Data table not refreshed ({})'.format(e))
+
+
+    def _fetch_and_prepare(self, model):
+        """Runs on the worker thread: run the model and prepare the data of the tabs.
+        Returns : the table dataset, or False if some mandatory fields are missing."""
+        model.run()
+
+        mandatory_fields = self.matrix_tab_scatter_x
+        if not model.get_model_data().columns.isin(mandatory_fields).any():
+            return False
+
+        # the default matrix gets computed (and cached) here rather than in the UI
+        model.set_data_as_matrix(self.matrix_tab_scatter_x[0], self.matrix_tab_scatter_y[0])
+        model.check_cancelled()
+
+        return self._prepare_table_data(model)
+
+
+    def _cancel_run(self, caller):
+        """Called upon button Cancel is clicked."""
+        _logger.info('Cancelling...')
+        self._button_cancel.disabled = True
+        self._model.cancel()
+
         
-    
     def _build_ui(self):
         """Build main frame of the user interface."""
         side_layout = ipywidgets.Layout(min_width='200px', margin='10px', overflow_x='hidden')
@@ -127,6 +301,16 @@ class PortfolioMonitorDemo(object):
         self._button_run = ipywidgets.Button(
             description='Run', button_style='info', icon='fa-play', layout=side_layout)
         self._button_run.on_click(self._run)
+
+        # Button Refresh (market data only, once a run is done)
+        self._button_refresh = ipywidgets.Button(
+            description='Refresh', button_style='info', icon='fa-refresh', disabled=True, layout=side_layout)
+        self._button_refresh.on_click(self._refresh)
+
+        # Button Cancel (active while a run is in progress)
+        self._button_cancel = ipywidgets.Button(
+            description='Cancel', button_style='warning', icon='fa-stop', disabled=True, layout=side_layout)
+        self._button_cancel.on_click(self._cancel_run)
         
         # Tabs for figures and tables
         self._main_tab = ipywidgets.Tab(layout={'margin': '10px'})
@@ -167,7 +351,7 @@ class PortfolioMonitorDemo(object):
         
          # Main UI Box
         side_box = ipywidgets.VBox([label_dropdown, self.univ_picker.show(), 
-                                    self._button_run], layout=side_layout)
+                                    self._button_run, self._button_refresh, self._button_cancel], layout=side_layout)
         main_box = ipywidgets.HBox([side_box, self._main_tab], layout={'overflow_x':'hidden'})
         ui = ipywidgets.VBox([main_box, _log_widget.get_widget()])
 
@@ -208,17 +392,19 @@ class PortfolioMonitorDemo(object):
                                     you want to see in the filters (top-part).</p>')
 
         # get the config from the default config file loaded
+        # any text field can be used as a filter of the table
+        fields_config = pd.concat([workbook.read_sheet('config.xlsx', 'hidden'), self.datatable_config], sort=False)
+        filter_options = [f for f in fields_config[fields_config.value_type == 'text'].field_name.unique() if f != 'Name']
+
         s2_filter_a_config = self.datatable_config[self.datatable_config['control_name'] == 'filter_a']
         s2_filter_a_config_default = s2_filter_a_config[s2_filter_a_config.default == 'y']
-        self.s2_filter_a = ipywidgets.Dropdown(options=list(s2_filter_a_config.field_name),
-                                                value=list(s2_filter_a_config_default.field_name)[0],
-                                                disabled=True) # just in case user sets more than one by default..
+        self.s2_filter_a = ipywidgets.Dropdown(options=filter_options, description='Filter A',
+                                                value=list(s2_filter_a_config_default.field_name)[0])
 
         s2_filter_b_config = self.datatable_config[self.datatable_config['control_name'] == 'filter_b']
         s2_filter_b_config_default = s2_filter_b_config[s2_filter_b_config.default == 'y']
-        self.s2_filter_b = ipywidgets.Dropdown(options=list(s2_filter_b_config.field_name),
-                                                value=list(s2_filter_b_config_default.field_name)[0],
-                                                disabled=True) # just in case user sets more than one by default..
+        self.s2_filter_b = ipywidgets.Dropdown(options=filter_options, description='Filter B',
+                                                value=list(s2_filter_b_config_default.field_name)[0])
 
         s2_label_bis = ipywidgets.HTML('<p>Multi-selectors control the items that define the \
                                             scatter plot in x- and y-axis and the color scale (bottom-part).</p>')
@@ -338,6 +524,8 @@ class PortfolioMonitorDemo(object):
         # set the button up!
         button_valide_universe = ipywidgets.Button(description='Load custom universe', button_style='info')
         button_valide_universe.on_click(self._run_from_settings_tab)
+        # disabled along with the Run button, ie. while a run or a refresh is in progress
+        ipywidgets.dlink((self._button_run, 'disabled'), (button_valide_universe, 'disabled'))
 
         output = ipywidgets.VBox([
                     label_instructions,
@@ -350,6 +538,11 @@ class PortfolioMonitorDemo(object):
 
 
     def _run_from_settings_tab(self, caller):
+        # a click may have been queued before the button got disabled
+        if self._button_run.disabled:
+            _logger.warn('A run is already in progress. Cancel it first.')
+            return
+
         # Drop any line containing garbage character
         tickers_1 = [c.strip() for c in self._list_1_section.value.splitlines() if c.isprintable()]
         tickers_2 = [c.strip() for c in self._list_2_section.value.splitlines() if c.isprintable()]
@@ -403,11 +596,9 @@ class PortfolioMonitorDemo(object):
         category_filter = self._drop_y.value
         row = event.get('data', {})['row']
 
-        # function of the category apply the `row` filter to country/sector
-        if category_filter == 'Country':
-            self._country_select.value = (row,)
-        elif category_filter == 'Industry':
-            self._sector_select.value = (row,)
+        # function of the category apply the `row` filter to the table filters
+        if category_filter in self._filter_selects:
+            self._filter_selects[category_filter].value = (row,)
 
         # display the second tab upon the click
         self._main_tab.selected_index = 1
@@ -442,6 +633,7 @@ class PortfolioMonitorDemo(object):
         self._update_matrix_ui()
 
 
+    @timing.timed('app.build_matrix')
     def _build_matrix(self):
         # create 2 dropdowns for the matrix selection
         self._drop_x = ipywidgets.Dropdown(options=self.matrix_tab_scatter_x)
@@ -486,17 +678,30 @@ class PortfolioMonitorDemo(object):
 
 # --------  end TAB # 1  ----------------------------------------------------------------
 # -----------   TAB # 2  ----------------------------------------------------------------
-    def _build_tables(self):
+    def _prepare_table_data(self, model):
+        """Reshape the model data nicely for display (no widget involved)."""
+        df_all = model.get_model_data().reset_index().round(1)
+        df_all['Country'] = df_all['Country'].str.title()
+        return df_all
+
+
+    @timing.timed('app.build_tables')
+    def _build_tables(self, df_all=None):
         """Build datagrid as a table based on factor model"""
         self._bool_no_scatter = False # boolean used to display only error message once if missing scatter chart
         
         # access the model data and reshape it nicely for display
-        df_all = self._model.get_model_data().reset_index().round(1)
-        df_all['Country'] = df_all['Country'].str.title()
+        if df_all is None:
+            df_all = self._prepare_table_data(self._model)
         
         # store this in model variable as need to access it from callbacks
         self._df_all = df_all
-        self._subset_data = df_all
+
+        # rows of the grid: rendered once, then shown/hidden by the filters
+        self._table = TableView(df_all)
+        self._filter_columns = [c for c in OrderedDict.fromkeys([self.table_tab_filter_a, self.table_tab_filter_b])
+                                if c in df_all]
+        self._filter_index = CategoryIndex(df_all, self._filter_columns)
 
         definition = [
             {'headerName': 'Securities',
@@ -513,13 +718,17 @@ class PortfolioMonitorDemo(object):
         # build the filters on top
         top_filters = self._build_filters_for_table()
 
-        # datagrid object to get displayed
-        self._data_grid = DataGrid(data=self._df_all.fillna('-').round(1), column_defs=definition, 
+        # datagrid object to get displayed: it only holds the rows of the current page
+        self._data_grid = DataGrid(data=self._table.page(0, 0)[0], column_defs=definition, 
                                     layout=ipywidgets.Layout(width='800px', height='480px'))
         self._data_grid.observe(self._hightlight_scatter, 'selected_row_indices')
 
+        # paging and sorting of the rows, done on the kernel side
+        paging = self._build_paging_for_table()
+        self._update_grid(start=0)
+
         # text label on top of the table
-        self._screen_box = ipywidgets.HTML('<h2>Results for selection ({} results)</h2>'.format(len(self._data_grid.data)))
+        self._screen_box = ipywidgets.HTML('<h2>Results for selection ({} results)</h2>'.format(len(self._table)))
 
         # text tooltip to let the user know about scroll
         tips = ipywidgets.HTML(value='''<i><font color="gray"><p>Mouse scroll available. 
@@ -538,7 +747,7 @@ class PortfolioMonitorDemo(object):
         self._button_rv.on_click(self._run_relative_comparision)
 
         # define the output object to get displayed
-        output = ipywidgets.VBox([self._screen_box, top_filters, self._data_grid, tips, 
+        output = ipywidgets.VBox([self._screen_box, top_filters, self._data_grid, paging, tips, 
                                     ipywidgets.HBox([_scatter_ui, ipywidgets.VBox([self._nb_selected_items, self._button_rv])])
                                 ])
         
@@ -548,7 +757,7 @@ class PortfolioMonitorDemo(object):
     def _run_relative_comparision(self, caller):
         try:
             if self._scatt.selected:
-                self.selected_elements = self._subset_data.loc[self._scatt.selected]
+                self.selected_elements = self._table.data.iloc[self._scatter_rows[list(self._scatt.selected)]]
                 # go to next screen (Relative valuation)
                 self._main_tab.selected_index = 2
                 self._run_model_portfolio()
@@ -558,35 +767,33 @@ class PortfolioMonitorDemo(object):
             try:
                 # in case no scatter plot (due to display issue), one may want to 
                 # access the selection from the data grid
-                self.selected_elements = self._data_grid.data.iloc[self._data_grid.selected_row_indices]
+                self.selected_elements = self._table.data.iloc[self._grid_rows[list(self._data_grid.selected_row_indices)]]
             except:
                 pass
 
 
     def _reset_button(self, caller):
-        if caller._id == 'Country':
-            self._country_select.value = list(sorted(self._df_all['Country'].unique()))
-        if caller._id == 'Industry':
-            self._sector_select.value = list(sorted(self._df_all['Industry'].unique()))
+        self._filter_selects[caller._id].value = self._filter_index.options(caller._id)
 
 
     def _filter_dataframe(self, caller):
         # retrieve the list of entries for each filters
-        country_filter_list = self._country_select.value
-        sector_filter_list  = self._sector_select.value
-        # build the mask of the dataset depending on each filter
-        sub_section_country = self._df_all['Country'].isin(country_filter_list)
-        sub_section_sector  = self._df_all['Industry'].isin(sector_filter_list)
-        
-        # apply the mask to the full dataset
-        new_df = self._df_all[sub_section_country & sub_section_sector]
-        self._subset_data = new_df.reset_index(drop=True)
+        selections = {c: w.value for c, w in self._filter_selects.items()}
+        # resolve the mask of the dataset from the precomputed filter index
+        mask = self._filter_index.mask(selections)
+
+        # apply the mask to the full dataset: nothing to send if the rows
+        # displayed did not change
+        added, removed = self._table.set_filter(mask)
+        if not len(added) and not len(removed):
+            return
 
         try:
-            self._data_grid.data = self._subset_data.fillna('-')
-            self._screen_box.value = '<h4>Results for selection ({} results)</h4>'.format(len(self._subset_data))
+            self._update_grid(start=0)
+            # rows counted from the mask, the filtered frame is never built
+            self._screen_box.value = '<h4>Results for selection ({} results)</h4>'.format(len(self._table))
             
-            # apply subset_data to the scatter plot as well
+            # apply the filtered rows to the scatter plot as well
             self._refresh_scatter_data()
 
             # update the reg line if activated
@@ -600,40 +807,78 @@ class PortfolioMonitorDemo(object):
         # specific layout for button  (big red cross)
         button_layout = {'width':'15px','height':'68px','margin':'4px 2px 0 2px', 'overflow_x':'hidden'}
 
-        # get unique list of filters
-        unique_countries = list(sorted(self._df_all['Country'].unique()))
-        unique_sectors = list(sorted(self._df_all['Industry'].unique()))
-
-        # create the multi-select
-        country_label = ipywidgets.HTML(value='Filter by Country')
-        self._country_select = ipywidgets.SelectMultiple(options=unique_countries, rows=4, value=unique_countries)
-        self._country_select.observe(self._filter_dataframe, 'value')
-
-        sector_label = ipywidgets.HTML(value='Filter by Industry')
-        self._sector_select = ipywidgets.SelectMultiple(options=unique_sectors, rows=4, value=unique_sectors)
-        self._sector_select.observe(self._filter_dataframe, 'value')
-
-        # create the button to reset the selection easily
-        country_reset = ipywidgets.Button(button_style='danger', description='x', layout=button_layout)
-        country_reset._id = 'Country'
-        country_reset.on_click(self._reset_button)
-        sector_reset = ipywidgets.Button(button_style='danger', description='x', layout=button_layout)
-        sector_reset._id = 'Industry'
-        sector_reset.on_click(self._reset_button)
-
-        ui_set_country = ipywidgets.HBox([
-                                ipywidgets.VBox([country_label,  
-                                                 ipywidgets.HBox([self._country_select, country_reset]),]),
-                                ipywidgets.VBox([sector_label,  
-                                                 ipywidgets.HBox([self._sector_select, sector_reset]),
-                                        ])
-            ])
-        return ui_set_country
+        # one multi-select per filter column, with all its values selected
+        self._filter_selects = OrderedDict()
+        ui_filters = []
+        for column in self._filter_columns:
+            options = self._filter_index.options(column)
+
+            label = ipywidgets.HTML(value='Filter by {}'.format(column))
+            select = ipywidgets.SelectMultiple(options=options, rows=4, value=options)
+            select.observe(self._filter_dataframe, 'value')
+            self._filter_selects[column] = select
+
+            # create the button to reset the selection easily
+            reset = ipywidgets.Button(button_style='danger', description='x', layout=button_layout)
+            reset._id = column
+            reset.on_click(self._reset_button)
+
+            ui_filters.append(ipywidgets.VBox([label, ipywidgets.HBox([select, reset])]))
+
+        return ipywidgets.HBox(ui_filters)
+
+
+    def _build_paging_for_table(self):
+        """Controls to move across the pages of the grid and to sort the rows."""
+        button_layout = {'width':'40px'}
+        self._grid_prev = ipywidgets.Button(icon='chevron-left', layout=button_layout)
+        self._grid_prev.on_click(lambda caller: self._update_grid(start=self._grid_start - self.__grid_page_size__))
+        self._grid_next = ipywidgets.Button(icon='chevron-right', layout=button_layout)
+        self._grid_next.on_click(lambda caller: self._update_grid(start=self._grid_start + self._grid_count))
+        # extend the current page rather than moving to the next one
+        self._grid_more = ipywidgets.Button(description='Load more', layout={'width':'90px'})
+        self._grid_more.on_click(lambda caller: self._update_grid(start=self._grid_start,
+                                                                  count=self._grid_count + self.__grid_page_size__))
+        self._grid_label = ipywidgets.HTML()
+
+        sortable = [c for c in self._df_all.columns if c != 'index']
+        self._grid_sort = ipywidgets.Dropdown(options=[('(none)', None)] + [(c, c) for c in sortable],
+                                              description='Sort by', layout={'width':'220px'})
+        self._grid_sort_desc = ipywidgets.Checkbox(description='Descending', value=False,
+                                                   style={'description_width':'initial'})
+        self._grid_sort.observe(self._sort_table, 'value')
+        self._grid_sort_desc.observe(self._sort_table, 'value')
+
+        return ipywidgets.HBox([self._grid_prev, self._grid_label, self._grid_next, self._grid_more,
+                                self._grid_sort, self._grid_sort_desc], layout={'margin':'5px 0 0 0'})
+
+
+    def _update_grid(self, start, count=None):
+        """Send to the grid the visible rows from `start` (one page by default)."""
+        count = self.__grid_page_size__ if count is None else count
+        total = len(self._table)
+        self._grid_start = max(min(start, total - 1), 0)
+        self._grid_count = count
+
+        data, self._grid_rows = self._table.page(self._grid_start, count)
+        self._data_grid.data = data
+
+        self._grid_label.value = '<p style="margin:0 10px">Rows {}-{} of {}</p>'.format(
+            min(self._grid_start + 1, total), self._grid_start + len(data), total)
+        self._grid_prev.disabled = self._grid_start == 0
+        self._grid_next.disabled = self._grid_more.disabled = self._grid_start + len(data) >= total
+
+
+    def _sort_table(self, caller):
+        self._table.set_sort(self._grid_sort.value, ascending=not self._grid_sort_desc.value)
+        self._update_grid(start=0)
 
 
     def _hightlight_scatter(self, caller):
         try:
-            idx = caller.new
+            # rows selected in the page -> points of the scatter (filtered rows)
+            rows = self._grid_rows[list(caller.new)]
+            idx = list(np.flatnonzero(np.isin(self._scatter_rows, rows)))
             self._scatt.selected = idx
 
             # and at the same time, update the text above the model portfolio button
@@ -648,22 +893,47 @@ class PortfolioMonitorDemo(object):
 
     def _on_distrib_hover(self, caller, event):
         try:
-            i = event.get('data', {})['index']
-            exclusion_list = ['index','Year to mat','US 10y T','intRating']
-            
-            # define the elements as list of ipywidgets to 
-            # store the item charateristics
-            elements = []
-            for e in self._subset_data.columns:
-                if not e in exclusion_list:
-                    elements.append(ipywidgets.HTML('<p><span style="font-weight:bold; color:dimgrey;">{}: </span> \
-                                                     <span>{}</span></p>'.format(e, self.df_temp_scatter.reset_index().loc[i,e])))
+            self._hover_pending = event.get('data', {})['index']
+
+            # coalesce rapid hovers: at most one tooltip update per interval,
+            # showing the last point hovered
+            wait = self._hover_last + self.__hover_interval__ - time.perf_counter()
+            if wait <= 0:
+                self._render_tooltip()
+            elif self._hover_handle is None:
+                loop = _running_loop()
+                if loop is None:
+                    self._render_tooltip()
+                else:
+                    self._hover_handle = loop.call_later(wait, self._render_tooltip)
+
+        except Exception as e:
+            _logger.warn('Small glitch while fetching tooltip data: {}'.format(e))
 
-            self._distrib_tooltip.children = elements
 
+    def _render_tooltip(self):
+        start = time.perf_counter()
+        self._hover_handle = None
+        try:
+            # swap the content of the single tooltip widget
+            row = self._scatter_rows[self._hover_pending]
+            self._distrib_tooltip_html.value = self._table.tooltip(row, exclude=self.__tooltip_exclusions__)
         except Exception as e:
             _logger.warn('Small glitch while fetching tooltip data: {}'.format(e))
 
+        self._hover_last = time.perf_counter()
+        self._hover_latency.append(self._hover_last - start)
+
+
+    def get_hover_latency(self):
+        """Return the p50/p95/max time (in seconds) spent rendering the scatter
+        tooltip, over the last hovers."""
+        if not self._hover_latency:
+            return {}
+        latency = np.array(self._hover_latency)
+        return {'count': len(latency), 'p50': np.percentile(latency, 50),
+                'p95': np.percentile(latency, 95), 'max': latency.max()}
+
 
     def _on_distrib_click(self, caller, event):
         try:
@@ -710,15 +980,29 @@ class PortfolioMonitorDemo(object):
     def _refresh_scatter_data(self):
         # retrieve the list of fields selected in the controls
         columns = '|'.join(str(e) for e in [self._x_control_scatter.value,self._y_control_scatter.value,self._z_control_scatter.value]).split('|')
-        # create a temp df to host the data only for the scatter 
-        self.df_temp_scatter = self._data_grid.data.replace('-',np.nan).dropna(axis=0, subset=columns)
+        # points of the scatter: the visible rows with a value on every axis
+        data = self._table.data
+        mask = self._table.visible_mask().copy()
+        for c in columns:
+            mask &= data[c].notnull().values
+        self._scatter_rows = np.flatnonzero(mask)
 
-        # assign the data to the scatter axis
-        self._scatt.x = self.df_temp_scatter[self._x_control_scatter.value]
-        self._scatt.y = self.df_temp_scatter[self._y_control_scatter.value]
-        self._scatt.color = self.df_temp_scatter[self._z_control_scatter.value]
+        # assign the data to the scatter axis (float arrays, taken as they are
+        # when every row is displayed)
+        def values(c):
+            v = data[c].to_numpy(dtype='float64')
+            return v if mask.all() else v[mask]
 
+        self._scatt.x = values(self._x_control_scatter.value)
+        self._scatt.y = values(self._y_control_scatter.value)
+        self._scatt.color = values(self._z_control_scatter.value)
 
+        # tooltips of the points, rendered once per data refresh rather than
+        # on the first hover (no-op if already rendered)
+        self._table.prepare_tooltips(exclude=self.__tooltip_exclusions__)
+
+
+    @timing.timed('app.build_scatter')
     def _build_scatter(self):
         '''
         Summary: main function that constructs the scatter plot
@@ -751,7 +1035,12 @@ class PortfolioMonitorDemo(object):
 
             
             # create the tooltip for scatter plot
-            self._distrib_tooltip = ipywidgets.VBox(layout={'width':'360px','height':'320px','overflow_y':'hidden'})
+            # (one HTML widget whose value is swapped on hover)
+            self._distrib_tooltip_html = ipywidgets.HTML()
+            self._distrib_tooltip = ipywidgets.VBox([self._distrib_tooltip_html],
+                                                    layout={'width':'360px','height':'320px','overflow_y':'hidden'})
+            self._hover_pending, self._hover_handle, self._hover_last = None, None, 0.
+            self._hover_latency = deque(maxlen=1000)
 
             # create the scatter object (scale, brusher, reg line, axis, and figure)
             sc_x, sc_y, sc_c = LinearScale(), LinearScale(), ColorScale(min=0)
@@ -819,21 +1108,22 @@ class PortfolioMonitorDemo(object):
         x_bounds = self._brusher.selected_x
         y_bounds = self._brusher.selected_y
 
-        # get the data from the current subset displayed in the table (in case some filtering)
-        d = self._subset_data
-
         # get the field names of the current dropdown selection
         x = self._x_control_scatter.value
         y = self._y_control_scatter.value
 
-        d_brushed = d[(d[x]>x_bounds[0]) & (d[x]<x_bounds[1]) & (d[y]>y_bounds[0]) & (d[y]<y_bounds[1])]
+        # mask over the whole table, the filters being applied on top of it
+        d = self._table.data
+        brushed = ((d[x]>x_bounds[0]) & (d[x]<x_bounds[1]) & (d[y]>y_bounds[0]) & (d[y]<y_bounds[1])).values
 
-        # apply the brushed data to the data table and to the model portfolio selection
-        self._data_grid.data = d_brushed#.fillna('-')
+        # apply the brushed data to the data table (only if the rows displayed changed)
+        added, removed = self._table.set_brush(brushed)
+        if len(added) or len(removed):
+            self._update_grid(start=0)
 
         #self.selected_elements = self._subset_data.iloc[self._scatt.selected]
-        self._nb_selected_items.value = 'Selected securities: {}'.format(len(d_brushed)) 
-        _logger.info('Selected securities by lasso: {}'.format(len(d_brushed)) )
+        self._nb_selected_items.value = 'Selected securities: {}'.format(len(self._table)) 
+        _logger.info('Selected securities by lasso: {}'.format(len(self._table)) )
 
 # --------  end TAB # 2  ----------------------------------------------------------------
 # -----------   TAB # 3  ----------------------------------------------------------------
@@ -854,7 +1144,6 @@ class PortfolioMonitorDemo(object):
                 tab3_children = [self._model_title]
                 # make sure the table can be displayed
                 model_df = self.selected_elements.set_index('index')[list(self.model_tab_header)]
-                model_df = model_df.replace('-',np.nan)
                 
                 # create the df.render for the data display
                 obj_df = self._final_to_html(model_df)
@@ -871,8 +1160,10 @@ class PortfolioMonitorDemo(object):
                 self._valuation_lines = self._construct_valuation_lines()
                 tab3_children.append(self._valuation_lines)
 
-                # run the bar chart display once after loading the page
-                self._on_item_select_change({'new':list(self.model_tab_select_x)[0]})
+                # fetch the history of every metric in one request (off the kernel
+                # thread), then display the first one
+                tickers = list(self.selected_elements['index'])
+                self._history_task = _schedule(self._prefetch_history(self._model, tickers, list(self.model_tab_select_x)))
 
                 # create a container with the dorpdown for the chart, the chart itself,
                 # and the save to portfolio button
@@ -983,17 +1274,80 @@ class PortfolioMonitorDemo(object):
             _logger.error('Cannot display final table. Going on...')
 
 
+    async def _prefetch_history(self, model, tickers, fields):
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(_executor, model.prefetch_history, tickers, fields, '-1y')
+        except Exception as e:
+            _logger.warn('History not prefetched ({})'.format(e))
+
+        # run the line chart display once the history is loaded, unless
+        # another Run or selection replaced the one it was fetched for
+        if model is not self._model or tickers != list(self.selected_elements['index']):
+            return
+        if self._item_select.value in fields:
+            self._show_history(self._item_select.value)
+
+
     def _on_item_select_change(self, caller):
         i = caller['new']
 
-        ## for LINE chart
+        # display what is in the history store, and fetch the rest off the
+        # kernel thread (the chart is drawn again once it is loaded)
         tickers = list(self.selected_elements['index'])
-        df = self._model._get_history(ids=tickers, field_name=i, history_period='-1y')
+        self._show_history(i)
+        if self._model.history_missing(tickers, [i], '-1y'):
+            self._history_task = _schedule(self._prefetch_history(self._model, tickers, [i]))
+
 
-        self._valuation_lines.marks[0].x = df.index
-        self._valuation_lines.marks[0].y = df.T.values
-        self._valuation_lines.marks[0].labels = list(df.columns)
+    def _show_history(self, i):
+        ## for LINE chart
+        tickers = list(self.selected_elements['index'])
+        self._valuation_history = self._model.read_history_window(ids=tickers, field_name=i, history_period='-1y')
+
+        # reset the zoom, then draw the whole period (once: the zoom observer
+        # draws it if the scale changed)
+        self._valuation_window = None
+        sc_x = self._valuation_lines.marks[0].scales['x']
+        with sc_x.hold_trait_notifications():
+            sc_x.min, sc_x.max = None, None
+        if self._valuation_window is None:
+            self._draw_valuation_lines()
+        self._valuation_lines.marks[0].labels = self._valuation_history[1]
         self._valuation_lines.title = 'Relative valuation ({})'.format(i)
+
+
+    def _draw_valuation_lines(self, start=None, end=None):
+        """Send to the line chart the history between `start` and `end`,
+        downsampled to the resolution of the chart."""
+        self._valuation_window = (start, end)
+        dates, found, values = self._valuation_history
+        if not found:
+            self._valuation_lines.marks[0].x, self._valuation_lines.marks[0].y = [], []
+            return
+
+        # window of dates displayed (a view of the history)
+        first = 0 if start is None else max(np.searchsorted(dates, np.datetime64(start, 'D')) - 1, 0)
+        last = len(dates) if end is None else np.searchsorted(dates, np.datetime64(end, 'D'), side='right') + 1
+
+        # points per series, so that the payload stays bounded whatever the
+        # number of securities and dates
+        n_buckets = max(min(self.__chart_width__, self.__chart_max_points__ // (2 * len(found))), 1)
+        x, y = downsample_minmax(dates[first:last], values[first:last], n_buckets)
+
+        with self._valuation_lines.marks[0].hold_sync():
+            self._valuation_lines.marks[0].x = x
+            self._valuation_lines.marks[0].y = y
+
+
+    def _on_valuation_zoom(self, change):
+        # re-sample the visible window at full resolution. min and max are
+        # notified one after the other: the window is only drawn once
+        sc_x = self._valuation_lines.marks[0].scales['x']
+        if getattr(self, '_valuation_history', None) is None:
+            return
+        if (sc_x.min, sc_x.max) != getattr(self, '_valuation_window', None):
+            self._draw_valuation_lines(start=sc_x.min, end=sc_x.max)
         
 
     def _construct_credit_bar(self):
@@ -1045,8 +1399,13 @@ class PortfolioMonitorDemo(object):
         # HTML label to indicate which date has been highlighted
         self._highlighted_text = ipywidgets.HTML()
 
+        # zoom on the dates: the lines are re-sampled on the visible window
+        sc_x.observe(self._on_valuation_zoom, ['min', 'max'])
+        panzoom = PanZoom(scales={'x': [sc_x]})
+
         # final figure, integrating the index_selector as interaction
-        fig_line = Figure(marks=[lines], axes=[ax_x, ax_y], title='Relative valuation', layout={'width': '99%', 'height': '400px'})
+        fig_line = Figure(marks=[lines], axes=[ax_x, ax_y], title='Relative valuation', interaction=panzoom,
+                          layout={'width': '99%', 'height': '400px'})
 
         return fig_line
 
@@ -1058,7 +1417,7 @@ class PortfolioMonitorDemo(object):
     class UniversePicker:   
         def __init__(self, layout=None):
             """Widgets for picking a universe. Index members and portfolio members are supported."""
-            config_file = pd.read_excel('config.xlsx', sheetname='controls')
+            config_file = workbook.read_sheet('config.xlsx', 'controls')
             self._default_index = config_file[config_file.control_name == 'index']['default'].values[0]
 
             widget_layout = {'width':'120px'}
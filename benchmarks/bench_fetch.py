@@ -0,0 +1,67 @@
+"""
+Benchmark of the fetch planner of `PortfolioMonitorModel` on a 'List'
+universe, against a fake BQL service injecting latency and failures.
+
+Run from anywhere:
+    python benchmarks/bench_fetch.py [--securities 5000] [--error-rate 0.2]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import fake_bql
+
+FIELDS = ['Name', 'Country', 'Industry', 'Year to mat', 'Yield to Worst', 'Z-Spread']
+
+
+def run_once(bq, tickers, chunk_size, workers, retries):
+    from model import PortfolioMonitorModel
+
+    # fresh reference cache: each run fetches everything
+    PortfolioMonitorModel.__reference_cache_path__ = os.path.join(tempfile.mkdtemp(), 'reference_cache.db')
+    PortfolioMonitorModel.__reference_cache__ = None
+
+    model = PortfolioMonitorModel('List', '\n'.join(tickers), 'Fixed Income', FIELDS, bq=bq)
+    # the chunk size alone decides of the plan here (no size threshold)
+    model.__fetch_chunk_min__ = 0
+    model.__fetch_chunk_size__ = chunk_size
+    model.__fetch_max_workers__ = workers
+    model.__fetch_retries__ = retries
+
+    start = time.perf_counter()
+    model.run()
+    elapsed = time.perf_counter() - start
+    return model, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--securities', type=int, default=5000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--latency-per-security', type=float, default=0.0002)
+    parser.add_argument('--error-rate', type=float, default=0.2)
+    args = parser.parse_args()
+
+    bq = fake_bql.install(latency=args.latency, latency_per_security=args.latency_per_security,
+                          error_rate=args.error_rate, seed=1)
+
+    # the model trims the last character of the first token (8-char tickers)
+    tickers = ['XS{:07d}0 Corp'.format(i) for i in range(args.securities)]
+
+    with fake_bql.working_directory():
+        for label, chunk_size, workers in [('single request', args.securities, 1),
+                                           ('chunked', args.chunk_size, args.workers)]:
+            model, elapsed = run_once(bq, tickers, chunk_size, workers, args.retries)
+            report = model.get_fetch_report()
+            statuses = [r['status'] for r in report]
+            print('{:<15} {:>7.2f}s  rows={:<6} requests={:<3} ok={} recovered={} failed={}'.format(
+                label, elapsed, len(model.get_model_data()), len(report),
+                statuses.count('ok'), statuses.count('recovered'), statuses.count('failed')))
+
+
+if __name__ == '__main__':
+    main()
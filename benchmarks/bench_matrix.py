@@ -0,0 +1,87 @@
+"""
+Benchmark of `PortfolioMonitorModel.set_data_as_matrix` against the former
+loop-based implementation (one boolean mask per bucket and per bin).
+The 'new' column times the computation itself (cache bypassed), the
+'cached' column a repeated call on the same (x, y) pair.
+
+Run from anywhere:
+    python benchmarks/bench_matrix.py [--sizes 1000 10000 100000] [--repeat 3]
+"""
+import argparse
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import fake_bql
+fake_bql.install()
+
+from model import PortfolioMonitorModel
+
+
+def legacy_set_data_as_matrix(data, x, y):
+    """Former implementation, kept as the reference for output and timings."""
+    bins_ = pd.qcut(data[x], 10, precision=6, retbins=True)[1:][0].round(1)
+    bins_ = np.insert(bins_, 0, 0)
+    bins = [(bins_[i], bins_[i + 1]) for i in range(len(bins_) - 1)]
+
+    bucket_list = sorted(data[y].unique())
+    df_matrix_x_y = pd.DataFrame(index=bucket_list, columns=bins)
+    for s in bucket_list:
+        section_data = data[data[y] == s]
+        for b in bins:
+            selected_subset = section_data[x].between(b[0], b[1])
+            df_matrix_x_y.at[s, b] = section_data[selected_subset][y].count()
+
+    df_matrix_x_y.replace(0, np.nan, inplace=True)
+    return df_matrix_x_y
+
+
+def make_universe(n_rows, n_buckets=60, seed=0):
+    """Synthetic bond universe with values rounded to 1 decimal (many values sit on bin edges)."""
+    rng = np.random.RandomState(seed)
+    countries = np.array(['C{:02d}'.format(i) for i in range(n_buckets)])
+    return pd.DataFrame({
+        'Country': countries[rng.randint(0, n_buckets, n_rows)],
+        'Year to mat': rng.gamma(2.0, 3.0, n_rows).round(1),
+    })
+
+
+def make_model(data):
+    """Model holding `data`, built without BQL nor config file."""
+    model = PortfolioMonitorModel.__new__(PortfolioMonitorModel)
+    model._data_version = 0
+    model._matrix_cache = OrderedDict()
+    model._matrix_cache_hits = 0
+    model._matrix_cache_misses = 0
+    model._data = data
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:>8} | {:>10} | {:>10} | {:>10} | {:>8}'.format('rows', 'legacy (s)', 'new (s)', 'cached (s)', 'speed-up'))
+    for n in args.sizes:
+        model = make_model(make_universe(n))
+
+        expected = legacy_set_data_as_matrix(model._data, 'Year to mat', 'Country')
+        result, _ = model._compute_matrix('Year to mat', 'Country')
+        pd.testing.assert_frame_equal(result, expected.astype('float64'))
+
+        t_old = min(timeit.repeat(lambda: legacy_set_data_as_matrix(model._data, 'Year to mat', 'Country'),
+                                  number=1, repeat=args.repeat))
+        t_new = min(timeit.repeat(lambda: model._compute_matrix('Year to mat', 'Country'),
+                                  number=1, repeat=args.repeat))
+        model.set_data_as_matrix('Year to mat', 'Country')
+        t_hit = min(timeit.repeat(lambda: model.set_data_as_matrix('Year to mat', 'Country'),
+                                  number=1, repeat=args.repeat))
+        print('{:>8} | {:>10.4f} | {:>10.4f} | {:>10.6f} | {:>7.0f}x'.format(n, t_old, t_new, t_hit, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
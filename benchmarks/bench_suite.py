@@ -0,0 +1,138 @@
+"""
+End-to-end benchmarks of the models against the fake BQL service: throughput
+and peak memory (traced Python allocations) of each step, on synthetic bond
+universes of several sizes.
+
+Run from anywhere:
+    python benchmarks/bench_suite.py [--sizes 1000 10000] [--missing-rate 0.02]
+                                     [--json results.json] [--baseline results.json]
+
+With --baseline, the run fails (exit code 1) if a step is slower than in the
+baseline by more than --tolerance, so that it can be used in CI.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fake_bql
+
+FIELDS = ['Name', 'Country', 'Industry', 'Payment rank', 'Maturity', 'Year to mat', 'Bloomberg',
+          'Yield to Worst', 'Z-Spread', 'Discount Margin', 'Z-Score']
+HEATMAP_QUERY = "get(#avg_rel_ret) for(members('{}'))"
+
+
+def measure(step, size, func, items):
+    """Run `func` once; returns a result row with its throughput (items/s) and
+    peak memory. `items` may be a callable, evaluated after the run."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    items = items() if callable(items) else items
+    return {'step': step, 'size': size, 'seconds': elapsed, 'items': items,
+            'throughput': items / elapsed if elapsed else float('inf'), 'peak_mb': peak / 1e6}
+
+
+def bench_portfolio_monitor(bq, size, history_ids):
+    from model import PortfolioMonitorModel
+
+    # fresh caches: the first run fetches everything
+    PortfolioMonitorModel.__reference_cache_path__ = os.path.join(tempfile.mkdtemp(), 'reference_cache.db')
+    PortfolioMonitorModel.__reference_cache__ = None
+    PortfolioMonitorModel.__history_store__ = None
+
+    model = PortfolioMonitorModel('Index', 'LP01TREU Index', 'Fixed Income', FIELDS, bq=bq)
+    rows = [measure('model.run', size, model.run, size)]
+    n = len(model.get_model_data())
+
+    # same universe again: reference fields served by the cache
+    model_cached = PortfolioMonitorModel('Index', 'LP01TREU Index', 'Fixed Income', FIELDS, bq=bq)
+    rows.append(measure('model.run (cached reference)', size, model_cached.run, size))
+
+    rows.append(measure('set_data_as_matrix', size,
+                        lambda: model._compute_matrix('Yield to Worst', 'Country'), n))
+
+    ids = list(model.get_model_data().index[:history_ids])
+    rows.append(measure('_get_history', size,
+                        lambda: model._get_history(ids, 'Z-Spread'), len(ids)))
+    rows.append(measure('_get_history (cached)', size,
+                        lambda: model._get_history(ids, 'Z-Spread'), len(ids)))
+    return rows
+
+
+def load_heatmap_model():
+    """Import the model of BQuant Lab #2 (a module also named `model`)."""
+    path = os.path.join(fake_bql.REPO_ROOT, 'BQuant Lab #2', 'model.py')
+    spec = importlib.util.spec_from_file_location('heatmap_model', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_heatmap(bq, size):
+    DataModel = load_heatmap_model().DataModel
+    model = DataModel(HEATMAP_QUERY.format('BWORLD Index'), asset_class='Equity', bq=bq)
+    # throughput in groups (rows of the response)
+    rows = [measure('heatmap.run', size, model.run, lambda: len(model.data))]
+    rows.append(measure('heatmap.build_2dim_dataset', size,
+                        lambda: model.build_2dim_dataset(model.data, x='Sector', y='Country',
+                                                         v='1m return', calc_type='median'),
+                        len(model.data)))
+    return rows
+
+
+def compare(rows, baseline, tolerance):
+    """Steps slower than their baseline by more than `tolerance` (a ratio)."""
+    reference = {(r['step'], r['size']): r for r in baseline}
+    regressions = []
+    for r in rows:
+        ref = reference.get((r['step'], r['size']))
+        if ref is not None and r['seconds'] > ref['seconds'] * (1 + tolerance):
+            regressions.append((r, ref))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--missing-rate', type=float, default=0.02)
+    parser.add_argument('--history-ids', type=int, default=200)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+
+    rows = []
+    with fake_bql.working_directory():
+        for size in args.sizes:
+            bq = fake_bql.install(universe_size=size, missing_rate=args.missing_rate)
+            rows += bench_portfolio_monitor(bq, size, args.history_ids)
+            rows += bench_heatmap(bq, size)
+
+    print('{:<30} {:>8} {:>9} {:>14} {:>10}'.format('step', 'size', 'seconds', 'items/s', 'peak MB'))
+    for r in rows:
+        print('{:<30} {:>8} {:>9.3f} {:>14,.0f} {:>10.1f}'.format(
+            r['step'], r['size'], r['seconds'], r['throughput'], r['peak_mb']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(rows, json.load(f), args.tolerance)
+        for r, ref in regressions:
+            print('REGRESSION {} (size {}): {:.3f}s vs {:.3f}s'.format(r['step'], r['size'], r['seconds'], ref['seconds']))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
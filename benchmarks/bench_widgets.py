@@ -0,0 +1,208 @@
+"""
+Headless benchmarks of the widget callbacks of the Portfolio Monitor app:
+latency of each callback and size of the widget state synced to the front-end
+per event, while replaying a trace of user interactions.
+
+The app is built for real (ipywidgets) against the fake BQL service and stub
+bqplot / bqwidgets / bqport modules (see fake_widgets.py), on a synthetic
+universe. A trace is a JSON list of events such as
+    {"event": "filter", "column": "Country", "values": ["France", "Germany"]}
+It is generated from a seed, or replayed from a file so that two versions of
+the app can be compared on the same interactions.
+
+Run from anywhere:
+    python benchmarks/bench_widgets.py [--sizes 1000 10000] [--events 300] [--seed 0]
+                                       [--trace trace.json | --save-trace trace.json]
+                                       [--json results.json]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+import fake_bql
+import fake_widgets
+
+# callback exercised by each event of a trace
+CALLBACKS = {
+    'matrix': '_update_matrix_change',
+    'filter': '_filter_dataframe',
+    'scatter_axis': '_refresh_scatter_data',
+    'brush': '_brusher_callback',
+    'hover': '_on_distrib_hover',
+    'item_select': '_on_item_select_change',
+}
+UNIVERSE = ('Index', 'LP01TREU Index')
+PORTFOLIO_SIZE = 20
+
+
+def build_demo(bq):
+    """Build every tab of the app as a Run would, with the data of `bq`."""
+    import app
+    from model import PortfolioMonitorModel
+
+    # fresh caches, so that each universe is fetched in full
+    PortfolioMonitorModel.__reference_cache_path__ = os.path.join(tempfile.mkdtemp(), 'reference_cache.db')
+    PortfolioMonitorModel.__reference_cache__ = None
+    PortfolioMonitorModel.__history_store__ = None
+
+    demo = app.PortfolioMonitorDemo()
+    demo.show()
+    fields = list(set(demo._read_from_settings()))
+    demo._model = PortfolioMonitorModel(UNIVERSE[0], UNIVERSE[1], 'Fixed Income', fields, bq=bq)
+    prepared = demo._fetch_and_prepare(demo._model)
+    demo._build_matrix()
+    demo._build_tables(prepared)
+    demo._build_model_portfolio()
+
+    # Model portfolio tab: a few securities, their history being prefetched
+    demo._scatt.selected = list(range(min(PORTFOLIO_SIZE, len(demo._scatter_rows))))
+    demo._run_relative_comparision(None)
+
+    # every hover renders its tooltip (no throttling) so that each one is measured
+    demo.__hover_interval__ = 0
+    return demo
+
+
+def generate_trace(demo, n_events, seed=0):
+    """Random interactions over the controls of `demo`."""
+    rng = random.Random(seed)
+    kinds = ['matrix', 'filter', 'scatter_axis', 'brush', 'hover', 'item_select']
+    weights = [1, 3, 1, 2, 8, 1]
+
+    trace = []
+    for kind in rng.choices(kinds, weights, k=n_events):
+        if kind == 'matrix':
+            axis = rng.choice(['x', 'y'])
+            options = demo._drop_x.options if axis == 'x' else demo._drop_y.options
+            trace.append({'event': kind, 'axis': axis, 'value': rng.choice(options)})
+        elif kind == 'filter':
+            column = rng.choice(list(demo._filter_selects))
+            options = demo._filter_index.options(column)
+            # mostly everything selected, sometimes a few values only
+            values = options if rng.random() < 0.3 else rng.sample(options, rng.randint(1, min(5, len(options))))
+            trace.append({'event': kind, 'column': column, 'values': list(values)})
+        elif kind == 'scatter_axis':
+            axis = rng.choice(['x', 'y', 'z'])
+            options = getattr(demo, '_{}_control_scatter'.format(axis)).options
+            trace.append({'event': kind, 'axis': axis, 'value': rng.choice(options)})
+        elif kind == 'brush':
+            # box between random quantiles of the current axes
+            qx, qy = sorted(rng.random() for _ in range(2)), sorted(rng.random() for _ in range(2))
+            trace.append({'event': kind, 'x': qx, 'y': qy})
+        elif kind == 'hover':
+            trace.append({'event': kind, 'index': rng.randrange(1 << 30)})
+        elif kind == 'item_select':
+            trace.append({'event': kind, 'value': rng.choice(demo._item_select.options)})
+    return trace
+
+
+def play(demo, event):
+    """Apply one event of a trace to `demo`, as the front-end would."""
+    kind = event['event']
+    if kind == 'matrix':
+        control = demo._drop_x if event['axis'] == 'x' else demo._drop_y
+        if event['value'] in control.options:
+            control.value = event['value']
+    elif kind == 'filter':
+        select = demo._filter_selects.get(event['column'])
+        if select is not None:
+            select.value = tuple(v for v in event['values'] if v in select.options)
+    elif kind == 'scatter_axis':
+        control = getattr(demo, '_{}_control_scatter'.format(event['axis']))
+        if event['value'] in control.options:
+            control.value = event['value']
+    elif kind == 'brush':
+        demo._brusher_callback(None)
+    elif kind == 'hover':
+        if len(demo._scatter_rows):
+            demo._on_distrib_hover(demo._scatt, {'data': {'index': event['index'] % len(demo._scatter_rows)}})
+    elif kind == 'item_select':
+        if event['value'] in demo._item_select.options:
+            demo._item_select.value = event['value']
+
+
+def before(demo, event):
+    """Changes made by the front-end itself ahead of an event (not measured)."""
+    if event['event'] == 'brush':
+        d = demo._table.data
+        x, y = d[demo._x_control_scatter.value].dropna(), d[demo._y_control_scatter.value].dropna()
+        demo._brusher.selected_x = np.quantile(x, event['x']) if len(x) else [0, 0]
+        demo._brusher.selected_y = np.quantile(y, event['y']) if len(y) else [0, 0]
+
+
+def replay(demo, recorder, trace):
+    """Play the trace; returns the latency (seconds), messages and bytes sent
+    of each event, by callback."""
+    samples = {name: [] for name in CALLBACKS.values()}
+    for event in trace:
+        before(demo, event)
+        with recorder.count() as sent:
+            start = time.perf_counter()
+            play(demo, event)
+            elapsed = time.perf_counter() - start
+        samples[CALLBACKS[event['event']]].append((elapsed, sent.messages, sent.bytes))
+    return samples
+
+
+def summarize(size, samples):
+    rows = []
+    for name, values in samples.items():
+        if not values:
+            continue
+        latency, messages, nbytes = (np.array(v, dtype='float64') for v in zip(*values))
+        p50, p95, p99 = np.percentile(latency * 1e3, [50, 95, 99])
+        rows.append({'callback': name, 'size': size, 'events': len(values),
+                     'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                     'messages': messages.mean(), 'mean_kb': nbytes.mean() / 1e3, 'max_kb': nbytes.max() / 1e3})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--events', type=int, default=300, help='events of a generated trace')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace', help='replay the events of this file instead of generating them')
+    parser.add_argument('--save-trace', help='write the generated trace to this file')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    save_trace, results = [os.path.abspath(p) if p else None for p in (args.save_trace, args.json)]
+
+    trace = None
+    if args.trace:
+        with open(args.trace) as f:
+            trace = json.load(f)
+
+    recorder = fake_widgets.install()
+    rows = []
+    # app.py starts its log file and run timings in the working directory
+    with fake_bql.working_directory():
+        for size in args.sizes:
+            bq = fake_bql.install(universe_size=size)
+            demo = build_demo(bq)
+            if trace is None:
+                trace = generate_trace(demo, args.events, args.seed)
+                if save_trace:
+                    with open(save_trace, 'w') as f:
+                        json.dump(trace, f, indent=1)
+            rows += summarize(size, replay(demo, recorder, trace))
+
+    print('{:<24} {:>7} {:>7} {:>9} {:>9} {:>9} {:>6} {:>10} {:>10}'.format(
+        'callback', 'size', 'events', 'p50 ms', 'p95 ms', 'p99 ms', 'msgs', 'mean KB', 'max KB'))
+    for r in rows:
+        print('{:<24} {:>7} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>6.1f} {:>10.1f} {:>10.1f}'.format(
+            r['callback'], r['size'], r['events'], r['p50_ms'], r['p95_ms'], r['p99_ms'],
+            r['messages'], r['mean_kb'], r['max_kb']))
+
+    if results:
+        with open(results, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+"""
+In-process stand-in for the `bql` module, so that the model files can be
+imported, run and measured without a Bloomberg terminal.
+
+Usage:
+    import fake_bql
+    bq = fake_bql.install(universe_size=10000)   # registers `bql` in sys.modules
+    from model import PortfolioMonitorModel
+    model = PortfolioMonitorModel('Index', 'LP01TREU Index', 'Fixed Income', fields, bq=bq)
+
+Values are deterministic: the same security and field always give the same
+value, whatever the universe or the request it comes from. Requests can be
+`bql.Request` objects (fields, or time series with `with_params={'start':..}`)
+or query strings such as the grouped queries of the Heatmap app (BQuant Lab #2).
+"""
+import os
+import re
+import sys
+import time
+import types
+import zlib
+import shutil
+import tempfile
+import datetime
+import threading
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+
+# root of the repository (where model.py / app.py live)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# workbooks read by the apps from their working directory, with their
+# compiled sidecars (see workbook.py)
+WORKBOOKS = ('config.xlsx', 'mapping.xlsx', 'config.xlsx.pkl', 'mapping.xlsx.pkl')
+
+COUNTRIES = ['US', 'GB', 'FR', 'DE', 'IT', 'ES', 'NL', 'BE', 'AT', 'IE', 'PT', 'FI', 'SE', 'DK', 'NO',
+             'CH', 'LU', 'PL', 'CZ', 'HU', 'RO', 'GR', 'JP', 'AU', 'CA', 'MX', 'BR', 'CL', 'CN', 'KR']
+SECTORS = ['Financials', 'Utilities', 'Energy', 'Industrials', 'Communications', 'Consumer Discretionary',
+           'Consumer Staples', 'Health Care', 'Materials', 'Technology', 'Real Estate', 'Government']
+PAYMENT_RANKS = ['Sr Unsecured', 'Secured', 'Sr Preferred', 'Subordinated', 'Jr Subordinated']
+COUNTRY_NAMES = ['United States', 'United Kingdom', 'France', 'Germany', 'Italy', 'Spain', 'Netherlands',
+                 'Belgium', 'Switzerland', 'Sweden', 'Japan', 'Australia', 'Canada', 'Brazil', 'China', 'NA']
+GICS_SECTORS = ['Energy', 'Materials', 'Industrials', 'Consumer Discretionary', 'Consumer Staples', 'Health Care',
+                'Financials', 'Information Technology', 'Communication Services', 'Utilities', 'Real Estate']
+RATINGS = ['AAA', 'AA+', 'AA', 'AA-', 'A+', 'A', 'A-', 'BBB+', 'BBB', 'BBB-',
+           'BB+', 'BB', 'BB-', 'B+', 'B', 'B-', 'CCC+', 'NR']
+
+
+class FakeBqlError(Exception):
+    """Error raised by the fake service when a failure is injected."""
+    pass
+
+
+def _uniform(ids, salt):
+    """Deterministic pseudo-random numbers in [0, 1), one per id (splitmix64)."""
+    x = np.array([zlib.crc32(str(i).encode()) for i in ids], dtype='uint64')
+    x = x * np.uint64(0x9E3779B97F4A7C15) + np.uint64(zlib.crc32(salt.encode()))
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype('float64') / float(2 ** 53)
+
+
+def _pick(choices, u):
+    return np.array(choices, dtype=object)[np.minimum((u * len(choices)).astype(int), len(choices) - 1)]
+
+
+# ----------------------------------------------------------------------------
+# Items, universes and namespaces (bq.data, bq.func, bq.univ)
+# ----------------------------------------------------------------------------
+
+def _expr(o):
+    return o.expr if isinstance(o, (Item, Universe)) else repr(o)
+
+
+class Item(object):
+    """Data item: the field it derives from and the expression built on it."""
+
+    def __init__(self, field, params=None, expr=None):
+        self.field = field
+        self.params = params or {}
+        self.expr = expr or '{}()'.format(field)
+
+    def __getattr__(self, name):
+        # chained calls: .zscore(), .last(), .dropna()...
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            return Item(self.field, self.params, '{}.{}()'.format(self.expr, name))
+        return method
+
+    def _op(self, other, symbol):
+        return Item(self.field, self.params, '({}{}{})'.format(self.expr, symbol, _expr(other)))
+
+    def __add__(self, other):
+        return self._op(other, '+')
+
+    def __sub__(self, other):
+        return self._op(other, '-')
+
+    def __mul__(self, other):
+        return self._op(other, '*')
+
+    def __truediv__(self, other):
+        return self._op(other, '/')
+
+    def __repr__(self):
+        return self.expr
+
+
+class Universe(object):
+    def __init__(self, ids, expr):
+        self.ids = list(ids)
+        self.expr = expr
+
+    def __repr__(self):
+        return self.expr
+
+
+class _DataNamespace(object):
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def item(**params):
+            return Item(name, params)
+        return item
+
+
+class _FuncNamespace(object):
+    def today(self):
+        return Item('today')
+
+    def round(self, item, digits=0):
+        return Item(item.field, item.params, 'round({}, {})'.format(_expr(item), digits))
+
+
+class _UnivNamespace(object):
+    def __init__(self, service):
+        self._service = service
+
+    def members(self, name):
+        return Universe(self._service.members_of(name), "members('{}')".format(name))
+
+    def list(self, tickers):
+        return Universe(tickers, 'list([{} securities])'.format(len(tickers)))
+
+
+class Request(object):
+    """Mimic `bql.Request(universe, items, with_params=None)`."""
+
+    def __init__(self, universe, items, with_params=None):
+        self.universe = universe
+        self.items = items
+        self.with_params = with_params or {}
+
+    def to_string(self):
+        items = ', '.join('{}={}'.format(k, _expr(v)) for k, v in self.items.items())
+        return 'get({}) for({})'.format(items, _expr(self.universe))
+
+
+# ----------------------------------------------------------------------------
+# Responses
+# ----------------------------------------------------------------------------
+
+class SingleItemResponse(object):
+    def __init__(self, name, df):
+        self.name = name
+        self._df = df
+
+    def df(self):
+        return self._df.copy()
+
+
+class Response(object):
+    """Mimic the response of `bql.Service.execute`: `.get(name)`, `.single()` and iteration."""
+
+    def __init__(self, items):
+        self._items = items
+
+    def get(self, name):
+        for item in self._items:
+            if item.name == name:
+                return item
+        raise KeyError(name)
+
+    def single(self):
+        if len(self._items) != 1:
+            raise ValueError('Response holds {} items'.format(len(self._items)))
+        return self._items[0]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+
+# ----------------------------------------------------------------------------
+# Service
+# ----------------------------------------------------------------------------
+
+class Service(object):
+    """
+    Fake `bql.Service`.
+    Parameters
+    ----------
+    universe_size: int
+        number of members returned by `univ.members()`
+    missing_rate: float
+        share of NaN values in each field
+    latency: float
+        fixed delay (seconds) of each request
+    latency_per_security: float
+        additional delay (seconds) per security requested
+    error_rate: float
+        probability for a request to fail with FakeBqlError
+    fail_ids: set
+        securities making any request containing them fail
+    seed: int
+        seed of the error injection
+    """
+
+    def __init__(self, universe_size=1000, missing_rate=0.02, latency=0.0, latency_per_security=0.0,
+                 error_rate=0.0, fail_ids=None, seed=0):
+        self.universe_size = universe_size
+        self.missing_rate = missing_rate
+        self.latency = latency
+        self.latency_per_security = latency_per_security
+        self.error_rate = error_rate
+        self.fail_ids = set(fail_ids or [])
+
+        self.data = _DataNamespace()
+        self.func = _FuncNamespace()
+        self.univ = _UnivNamespace(self)
+
+        self._rng = np.random.RandomState(seed)
+        self._lock = threading.Lock()
+        self.requests = []
+
+    def members_of(self, name):
+        prefix = name.split(' ')[0][:4].upper()
+        return ['{}{:07d} Corp'.format(prefix, i) for i in range(self.universe_size)]
+
+    def execute(self, request):
+        if isinstance(request, str):
+            return self.execute_query(request)
+
+        # a plain list of tickers is accepted as universe, as with BQL
+        universe = request.universe
+        ids = universe.ids if isinstance(universe, Universe) else list(universe)
+        with self._lock:
+            self.requests.append(request)
+            fail = self._rng.rand() < self.error_rate
+
+        time.sleep(self.latency + self.latency_per_security * len(ids))
+        if fail:
+            raise FakeBqlError('Injected failure')
+        if self.fail_ids.intersection(ids):
+            raise FakeBqlError('Injected failure on {}'.format(sorted(self.fail_ids.intersection(ids))[0]))
+
+        items = []
+        for name, item in request.items.items():
+            if 'start' in request.with_params:
+                df = self.history(ids, item, request.with_params['start'])
+            else:
+                values = self.values(ids, item)
+                df = pd.DataFrame({name: values}, index=pd.Index(ids, name='ID'))
+            items.append(SingleItemResponse(name, df.rename(columns={'value': name})))
+        return Response(items)
+
+    def execute_query(self, query):
+        """
+        Answer a BQL query string grouped by country (and sector or announce
+        date), as used by the Heatmap app: one row per group, the ID being the
+        group keys joined by ':'. Some groups are 'NullGroup' or in 'NA'.
+        """
+        match = re.search(r"members\('([^']+)'\)", query)
+        ids = self.members_of(match.group(1) if match else 'UNIV')
+        with self._lock:
+            self.requests.append(query)
+        time.sleep(self.latency + self.latency_per_security * len(ids))
+
+        if '#amt' in query:
+            # fixed income issuance: year x month x country
+            years = [str(y) for y in range(2010, 2026)]
+            keys = [(y, m, c) for y in years for m in range(1, 13) for c in COUNTRIES + ['NullGroup']]
+            group_ids = ['{}:{}:{}'.format(*k) for k in keys]
+            df = pd.DataFrame({'#amt': 1000 * _uniform(group_ids, '#amt'),
+                               'YEAR(ANNOUNCE_DATE())': [float(k[0]) for k in keys],
+                               'MONTH(ANNOUNCE_DATE())': [float(k[1]) for k in keys],
+                               'CNTRY_OF_RISK()': [k[2] for k in keys]},
+                              index=pd.Index(group_ids, name='ID'))
+            name = '#amt'
+        else:
+            # equity relative returns: country x sector
+            keys = [(c, g) for c in COUNTRY_NAMES for g in GICS_SECTORS] + [('NullGroup', g) for g in GICS_SECTORS]
+            group_ids = ['{}:{}'.format(*k) for k in keys]
+            df = pd.DataFrame({'#avg_rel_ret': (_uniform(group_ids, '#avg_rel_ret') - 0.5) * 20,
+                               'COUNTRY_FULL_NAME()': [k[0] for k in keys],
+                               'GICS_SECTOR_NAME()': [k[1] for k in keys]},
+                              index=pd.Index(group_ids, name='ID'))
+            name = '#avg_rel_ret'
+
+        df['CURRENCY'] = 'USD'
+        return Response([SingleItemResponse(name, df)])
+
+    def history(self, ids, item, start):
+        """Daily values of `item` since `start` ('-1y', '-6m', '-10d' or a date),
+        one row per (security, business day) indexed by ID, as BQL returns them."""
+        today = pd.Timestamp.today().normalize()
+        if start.startswith('-'):
+            units = {'y': 'years', 'm': 'months', 'w': 'weeks', 'd': 'days'}
+            first = today - pd.DateOffset(**{units[start[-1]]: int(start[1:-1])})
+        else:
+            first = pd.Timestamp(start)
+        dates = pd.bdate_range(first, today)
+
+        # random walk around the current value, the same whatever `start` is
+        level = self.values(ids, item).astype('float64')
+        steps = np.array([_uniform(ids, '{}-{}'.format(item.field, d.toordinal())) - 0.5 for d in dates])
+        values = level * (1 + 0.01 * steps)
+
+        return pd.DataFrame({'DATE': np.tile(dates.values, len(ids)),
+                             'value': values.T.ravel()},
+                            index=pd.Index(np.repeat(ids, len(dates)), name='ID'))
+
+    def values(self, ids, item):
+        """Deterministic values of `item` for each of the `ids`."""
+        u = _uniform(ids, item.field)
+        field, expr = item.field, item.expr
+
+        if 'zscore' in expr:
+            values = (_uniform(ids, 'zscore') - 0.5) * 5
+        elif 'today' in expr:
+            values = (0.3 + 30 * u ** 2).round(6)
+        elif field == 'name':
+            values = np.array(['Issuer {} {:.3f} {}'.format(str(i)[:8], 1 + 6 * v, 2025 + int(30 * v ** 2))
+                               for i, v in zip(ids, u)], dtype=object)
+        elif field == 'cntry_of_risk':
+            values = _pick(COUNTRIES, u)
+        elif field == 'bics_level_1_sector_name':
+            values = _pick(SECTORS, u)
+        elif field == 'payment_rank':
+            values = _pick(PAYMENT_RANKS, u)
+        elif field == 'bb_composite':
+            values = _pick(RATINGS, u)
+        elif field == 'maturity':
+            today = np.datetime64(datetime.date.today(), 'D')
+            values = today + (365.25 * (0.3 + 30 * u ** 2)).astype('timedelta64[D]')
+        elif field == 'yield_':
+            values = 0.2 + 8 * u
+        elif field == 'spread':
+            values = 20 + 600 * u ** 2
+        elif field == 'disc_margin':
+            values = 10 + 300 * u
+        else:
+            values = 100 * u
+
+        # blank out some values (same securities for a given field)
+        missing = _uniform(ids, 'missing-' + field) < self.missing_rate
+        values = pd.Series(values)
+        values[missing] = None
+        return values.values
+
+
+def install(path=REPO_ROOT, **service_kwargs):
+    """Register this module as `bql`, make `path` importable and return a Service.
+    `bql.Service()` created by the models use the same `service_kwargs`."""
+    module = types.ModuleType('bql')
+    module.Request = Request
+    module.Service = lambda: Service(**service_kwargs)
+    sys.modules['bql'] = module
+
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+    return Service(**service_kwargs)
+
+
+@contextlib.contextmanager
+def working_directory():
+    """Run the apps from a temporary directory holding a copy of their
+    workbooks, so that the files they write (log, run timings, caches) do not
+    land in the repository, which stays importable. Removed on exit."""
+    cwd = os.getcwd()
+    path = tempfile.mkdtemp(prefix='bench-')
+    for name in WORKBOOKS:
+        if os.path.exists(os.path.join(REPO_ROOT, name)):
+            shutil.copy2(os.path.join(REPO_ROOT, name), path)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(cwd)
+        # files still open (eg. the log of the app) are left on Windows
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,237 @@
+"""
+Headless stand-ins for the widget libraries of BQNT (`bqplot`, `bqwidgets`,
+`bqport`, `bqviz`), so that the apps can be built and driven without a
+front-end. The stubs are real ipywidgets: their traits are synced like those
+of the actual libraries (numerical arrays as binary buffers, frames of the
+DataGrid as records), and every message that would reach the browser goes
+through a recording comm.
+
+Usage:
+    import fake_widgets
+    recorder = fake_widgets.install()       # registers the modules
+    ...
+    with recorder.count() as sent:
+        widget.value = 1
+    print(sent.messages, sent.bytes)
+"""
+import sys
+import json
+import types
+import contextlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+import comm
+import ipywidgets
+from traitlets import Any, List
+
+
+# ----------------------------------------------------------------------------
+# Recording of the messages sent to the front-end
+# ----------------------------------------------------------------------------
+
+class _Counter(object):
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+
+def _buffer_size(b):
+    return memoryview(b).nbytes
+
+
+class Recorder(object):
+    """Count the messages (and their size in bytes) sent by the widgets.
+    Only the messages sent from the thread that opened the count are counted,
+    so that the updates of the log widget (flushed by a timer) are left out."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = []
+
+    def record(self, data, buffers):
+        thread = threading.get_ident()
+        with self._lock:
+            counters = [c for t, c in self._counters if t == thread]
+        if not counters:
+            return
+        size = len(json.dumps(data, default=str)) + sum(_buffer_size(b) for b in buffers or [])
+        for c in counters:
+            c.messages += 1
+            c.bytes += size
+
+    @contextlib.contextmanager
+    def count(self):
+        item = (threading.get_ident(), _Counter())
+        with self._lock:
+            self._counters.append(item)
+        try:
+            yield item[1]
+        finally:
+            with self._lock:
+                self._counters.remove(item)
+
+
+def _recording_comm_class(recorder):
+    class RecordingComm(comm.DummyComm):
+        def publish_msg(self, msg_type, data=None, metadata=None, buffers=None, **keys):
+            recorder.record(data, buffers)
+    return RecordingComm
+
+
+# ----------------------------------------------------------------------------
+# Serialization, as done by bqplot / bqwidgets
+# ----------------------------------------------------------------------------
+
+def _array_to_json(value, widget):
+    if value is None:
+        return None
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        value = value.values
+    a = np.asarray(value)
+    if a.dtype.kind == 'M':
+        a = a.astype('datetime64[ms]').astype('float64')
+    if a.dtype.kind in 'fiub':
+        a = np.ascontiguousarray(a, dtype='float64' if a.dtype.kind == 'f' else a.dtype)
+        return {'value': memoryview(a), 'dtype': str(a.dtype), 'shape': a.shape}
+    return a.tolist()
+
+
+def _frame_to_json(value, widget):
+    if value is None:
+        return []
+    return value.to_dict(orient='records')
+
+
+array_serialization = {'to_json': _array_to_json}
+frame_serialization = {'to_json': _frame_to_json}
+
+
+class _StubWidget(ipywidgets.DOMWidget):
+    """Widget accepting any keyword: traits are set as such, the others as attributes."""
+
+    def __init__(self, **kwargs):
+        traits = {k: v for k, v in kwargs.items() if self.has_trait(k)}
+        super().__init__(**traits)
+        for k, v in kwargs.items():
+            if k not in traits:
+                setattr(self, k, v)
+
+
+# ----------------------------------------------------------------------------
+# bqplot
+# ----------------------------------------------------------------------------
+
+class _Scale(_StubWidget):
+    min = Any(None).tag(sync=True, **array_serialization)
+    max = Any(None).tag(sync=True, **array_serialization)
+
+
+class _Mark(_StubWidget):
+    x = Any(None).tag(sync=True, **array_serialization)
+    y = Any(None).tag(sync=True, **array_serialization)
+    color = Any(None).tag(sync=True, **array_serialization)
+    row = Any(None).tag(sync=True, **array_serialization)
+    column = Any(None).tag(sync=True, **array_serialization)
+    labels = Any(None).tag(sync=True, **array_serialization)
+    selected = Any(None).tag(sync=True, **array_serialization)
+    tooltip = Any(None).tag(sync=True, **ipywidgets.widget_serialization)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.hover_handlers = []
+        self.click_handlers = []
+
+    def on_hover(self, callback):
+        self.hover_handlers.append(callback)
+
+    def on_element_click(self, callback):
+        self.click_handlers.append(callback)
+
+
+class Axis(_StubWidget):
+    label = Any('').tag(sync=True)
+
+
+class Figure(_StubWidget):
+    marks = List().tag(sync=True, **ipywidgets.widget_serialization)
+    axes = List().tag(sync=True, **ipywidgets.widget_serialization)
+    title = Any('').tag(sync=True)
+
+
+class BrushSelector(_StubWidget):
+    selected_x = Any(None).tag(sync=True, **array_serialization)
+    selected_y = Any(None).tag(sync=True, **array_serialization)
+    brushing = Any(False).tag(sync=True)
+
+
+class IndexSelector(_StubWidget):
+    selected = Any(None).tag(sync=True, **array_serialization)
+
+
+class PanZoom(_StubWidget):
+    pass
+
+
+class Tooltip(_StubWidget):
+    pass
+
+
+def _bqplot_modules():
+    bqplot = types.ModuleType('bqplot')
+    for name in ['LinearScale', 'OrdinalScale', 'ColorScale', 'DateScale']:
+        setattr(bqplot, name, type(name, (_Scale,), {}))
+    for name in ['GridHeatMap', 'Scatter', 'Lines', 'Bars']:
+        setattr(bqplot, name, type(name, (_Mark,), {}))
+    bqplot.Axis, bqplot.ColorAxis = Axis, type('ColorAxis', (Axis,), {})
+    bqplot.Figure, bqplot.Tooltip = Figure, Tooltip
+
+    interacts = types.ModuleType('bqplot.interacts')
+    interacts.BrushSelector, interacts.IndexSelector, interacts.PanZoom = BrushSelector, IndexSelector, PanZoom
+    bqplot.interacts = interacts
+    return bqplot, interacts
+
+
+# ----------------------------------------------------------------------------
+# bqwidgets, bqport, bqviz
+# ----------------------------------------------------------------------------
+
+class DataGrid(_StubWidget):
+    data = Any(None).tag(sync=True, **frame_serialization)
+    column_defs = Any(None).tag(sync=True)
+    selected_row_indices = List().tag(sync=True)
+
+
+class TickerAutoComplete(_StubWidget):
+    value = Any('').tag(sync=True)
+
+
+def _bq_modules():
+    bqwidgets = types.ModuleType('bqwidgets')
+    bqwidgets.DataGrid, bqwidgets.TickerAutoComplete = DataGrid, TickerAutoComplete
+
+    bqport = types.ModuleType('bqport')
+    bqport.list_portfolios = lambda: []
+    bqport.PositionType = types.SimpleNamespace(SIZED='SIZED')
+
+    def new_portfolio(**kwargs):
+        raise NotImplementedError('Portfolios cannot be saved offline')
+    bqport.new_portfolio = new_portfolio
+
+    bqviz = types.ModuleType('bqviz')
+    return bqwidgets, bqport, bqviz
+
+
+def install():
+    """Register the stub modules and record the messages of every widget
+    created from now on. Returns : the Recorder"""
+    bqplot, interacts = _bqplot_modules()
+    bqwidgets, bqport, bqviz = _bq_modules()
+    sys.modules.update({'bqplot': bqplot, 'bqplot.interacts': interacts, 'bqwidgets': bqwidgets,
+                        'bqport': bqport, 'bqviz': bqviz})
+
+    recorder = Recorder()
+    comm.create_comm = _recording_comm_class(recorder)
+    return recorder
@@ -3,16 +3,152 @@ import numpy as np
 import logging
 from collections import OrderedDict
 import functools
+import threading
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 import bql
+import workbook
+import timing
+from refcache import ReferenceCache
+from timeseries import TimeSeriesStore
 
 _logger = logging.getLogger('PortfolioMonitorDemo')
 
+
+def _count_in_bins(buckets, values, bucket_list, bins):
+    """
+    Count, for each bucket, the values falling in each (low, high) bin.
+    Bounds are inclusive on both sides (same as `Series.between`), so a
+    value sitting on an edge is counted in the two bins sharing it.
+    Inputs:
+        - buckets (pd.Series): bucket label of each row
+        - values (pd.Series): numerical value of each row
+        - bucket_list (list): ordered bucket labels (rows of the output)
+        - bins (list): ordered (low, high) tuples (columns of the output)
+    Returns a 2-dim np.array of shape (len(bucket_list), len(bins)).
+    """
+    edges = np.unique(np.array(bins, dtype='float64').ravel())
+    n_slots = 2 * len(edges) + 1
+
+    # code each row once: bucket position and 'slot' against the sorted edges
+    # (slot 2i+1 is a value equal to edges[i], slot 2i is strictly in-between)
+    bucket_codes = pd.Categorical(buckets, categories=bucket_list).codes
+    x = np.asarray(values, dtype='float64')
+    pos = np.searchsorted(edges, x, side='left')
+    on_edge = edges[np.minimum(pos, len(edges) - 1)] == x
+    slots = 2 * pos + on_edge
+
+    # one single count over the (bucket, slot) pairs, then cumulate along slots
+    valid = (bucket_codes >= 0) & ~np.isnan(x)
+    flat = bucket_codes[valid].astype('int64') * n_slots + slots[valid]
+    hist = np.bincount(flat, minlength=len(bucket_list) * n_slots).reshape(len(bucket_list), n_slots)
+    cumul = np.concatenate([np.zeros((len(bucket_list), 1), dtype='int64'), hist.cumsum(axis=1)], axis=1)
+
+    # a bin [low, high] covers the slots 2*i(low)+1 to 2*i(high)+1
+    low = 2 * np.searchsorted(edges, [b[0] for b in bins]) + 1
+    high = 2 * np.searchsorted(edges, [b[1] for b in bins]) + 2
+    counts = cumul[:, high] - cumul[:, low]
+
+    return np.clip(counts, 0, None).astype('float64')
+
+
+def _map_column(values, mapping):
+    """
+    Translate `values` with the `mapping` series (index: code, values: label).
+    Returns the mapped series, and the number of non-empty values that
+    could not be found in the mapping (these are set to NaN).
+    """
+    # a code has to be unique and defined to be used as a key
+    mapping = mapping[mapping.index.notnull() & ~mapping.index.duplicated()]
+    mapped = values.map(mapping)
+    return mapped, int((mapped.isnull() & values.notnull()).sum())
+
+
+def _period_start(period, today):
+    """First date covered by a BQL relative period such as '-1y', '-6m' or '-10d'."""
+    units = {'y': 'years', 'm': 'months', 'w': 'weeks', 'd': 'days'}
+    try:
+        return today - pd.DateOffset(**{units[period[-1].lower()]: abs(int(period[:-1]))})
+    except (KeyError, ValueError, IndexError):
+        return pd.Timestamp.min
+
+
+class RunCancelled(Exception):
+    """Raised from `PortfolioMonitorModel.run` when the run has been cancelled."""
+    pass
+
+
+# dtype used to store each `value_type` declared in config.xlsx
+_SCHEMA_DTYPES = {'text': 'category', 'numerical': 'float64', 'date': 'datetime64[ns]'}
+
+
+def _apply_schema(df, schema):
+    """
+    Convert the columns of `df` to the dtype of their declared value_type.
+    Text columns only become categorical when values repeat (eg. Country,
+    Industry), as a category per row (eg. Name) would not save any memory.
+    Inputs:
+        - df (pd.DataFrame): raw dataset
+        - schema (dict): field name -> value_type ('text', 'numerical', 'date')
+    """
+    df = df.copy()
+    for field, value_type in schema.items():
+        if field not in df or value_type not in _SCHEMA_DTYPES:
+            continue
+        try:
+            if value_type == 'numerical':
+                df[field] = pd.to_numeric(df[field], errors='coerce').astype('float64')
+            elif value_type == 'date':
+                df[field] = pd.to_datetime(df[field], errors='coerce').astype('datetime64[ns]')
+            elif df[field].nunique() < len(df) / 2:
+                df[field] = df[field].astype('category')
+        except Exception as e:
+            _logger.warn('Cannot convert {} to {} ({})'.format(field, value_type, e))
+
+    return df
+
+
 class PortfolioMonitorModel(object):
     """Model for requesting data and calculate price impacts."""
 
     # BQL Service instance shared across FactorModel instances.
     __shared_bq__ = None    # Definition of label for data retrieval from BQL
+
+    # Max number of (x, y) matrices kept in the cache
+    __matrix_cache_size__ = 16
+
+    # Fetch plan for 'List' universes: lists up to `__fetch_chunk_min__`
+    # securities go in one request (benchmarks/bench_fetch.py shows no gain
+    # below), longer ones in chunks of `__fetch_chunk_size__` requested
+    # concurrently. A failed request is retried, after a delay doubling from
+    # `__fetch_backoff__` seconds
+    __fetch_chunk_min__ = 2000
+    __fetch_chunk_size__ = 500
+    __fetch_max_workers__ = 4
+    __fetch_retries__ = 2
+    __fetch_backoff__ = 0.5
+
+    # Persistent cache of the reference fields, ie. the fields with a
+    # ttl_days declared in config.xlsx (shared across instances)
+    __reference_cache_path__ = 'reference_cache.db'
+    __reference_cache__ = None
+
+    # days after which the members of a universe not used are dropped from
+    # the reference cache
+    __universe_cache_days__ = 30
+
+    # Store of the time series of the Model Portfolio tab (shared across
+    # instances). Set a directory to memory-map the histories to disk.
+    __history_store_path__ = None
+    __history_store__ = None
+
+    # Fields slow to compute: requested on their own to not delay the others
+    __heavy_fields__ = ('Z-Score',)
+
+    # Fields updated by `refresh` (intraday market data)
+    __volatile_fields__ = ('Yield to Worst', 'Z-Spread', 'Discount Margin', 'Z-Score')
     
     def __init__(self, universe_type, universe_value, asset, fields, bq=None):
         """Initialize the model.
@@ -32,8 +168,40 @@ class PortfolioMonitorModel(object):
         self._asset = asset
         self._user_fields = fields
         self._bq = bq
-        config_file = pd.read_excel('config.xlsx', sheetname='controls')
+
+        # LRU cache of the computed matrices, keyed by (x, y, data version)
+        self._data_version = 0
+        self._matrix_cache = OrderedDict()
+        self._matrix_cache_hits = 0
+        self._matrix_cache_misses = 0
+
+        # number of codes not found in mapping.xlsx during the last run
+        self._unmapped = dict()
+
+        # set from another thread to stop an in-flight run
+        self._cancel_event = threading.Event()
+
+        # outcome of each request sent during the last fetch
+        self._fetch_report = []
+
+        # serializes the history fetches of this instance
+        self._history_lock = threading.Lock()
+
+        config_file = workbook.read_sheet('config.xlsx', 'controls')
         self._float_fields_only = config_file[config_file.value_type == 'numerical'].field_name.tolist()
+
+        # declared type of every field (text, numerical or date)
+        hidden = workbook.read_sheet('config.xlsx', 'hidden')
+        fields_config = pd.concat([hidden, config_file], sort=False)
+        fields_config = fields_config[['field_name', 'value_type']].dropna().drop_duplicates('field_name', keep='last')
+        self._schema = dict(zip(fields_config.field_name, fields_config.value_type))
+
+        # time-to-live (in seconds) of the reference fields kept in cache
+        if 'ttl_days' in hidden:
+            hidden = hidden[hidden.ttl_days > 0]
+            self._ttls = dict(zip(hidden.field_name, hidden.ttl_days * 86400.))
+        else:
+            self._ttls = dict()
         
     def _init_bql(self):
         """Loads self._bq from class-level shared BQL instance if no instance is available yet.
@@ -47,40 +215,130 @@ class PortfolioMonitorModel(object):
             self._bq = PortfolioMonitorModel.__shared_bq__
             
         
+    def cancel(self):
+        """Ask an in-flight run to stop at its next step (thread-safe)."""
+        self._cancel_event.set()
+
+    def reset_cancel(self):
+        """Clear a previous cancel. To be called on the thread handling the
+        Cancel button before a job is submitted, so that a cancel sent while
+        the job is still queued is not lost."""
+        self._cancel_event.clear()
+
+    def check_cancelled(self):
+        """Raise RunCancelled if the run has been cancelled."""
+        if self._cancel_event.is_set():
+            raise RunCancelled()
+
+    @timing.timed('model.run', measure=lambda result, self: self._data)
     def run(self):
-        """Run the model"""
+        """Run the model. Raises RunCancelled if `cancel` is called meanwhile."""
         # Initiate BQL service lazily.
         self._init_bql()
         
-        # Define universe based on user inputs
-        univ = self._build_univ()
-        
         # build factors items for this model (returns a dict)
         factor_items = self._build_factors(user_selection=self._user_fields)
 
         # get the top factors scores
         _logger.info('Fetching market data...')
-        raw_data = self._get_data(univ, factor_items)
+        if self._univ_type == 'List' and self._univ_value:
+            # large custom lists are split in several requests
+            raw_data = self._get_data_chunked(self._parse_tickers(), factor_items)
+        else:
+            # Define universe based on user inputs
+            univ = self._build_univ()
+            raw_data = self._get_data(univ, factor_items)
         self._options_list = list(factor_items.keys())
+        self.check_cancelled()
 
         self._data = raw_data
         _logger.info('Cleaning data...')
 
         # load the excel file for mapping data (nicer display)
         try:
-            country_map = pd.read_excel('mapping.xlsx', sheetname='Countries', index_col='Code')
-            self._data['Country'] = self._data.apply(lambda x: country_map.loc[x['Country']]['Name'], axis=1)
-
-            rating_map = pd.read_excel('mapping.xlsx', sheetname='Ratings', index_col='Bloomberg')
-            self._data['intRating'] = self._data.apply(lambda x:rating_map.loc[x['Bloomberg']]['Score'], axis=1)
-            #self._data['Credit type'] = self._data.apply(lambda x:rating_map.loc[x['Bloomberg']]['Credit type'], axis=1)
-            #self._data['Credit description'] = self._data.apply(lambda x:rating_map.loc[x['Bloomberg']]['Credit description'], axis=1)
+            country_map = workbook.read_sheet('mapping.xlsx', 'Countries', index_col='Code')
+            rating_map = workbook.read_sheet('mapping.xlsx', 'Ratings', index_col='Bloomberg')
+        except Exception as e:
+            _logger.warn('Mapping table not loaded. Going on ({})'.format(e))
+        else:
+            # unknown codes are mapped to NaN and counted
+            self._unmapped = dict()
+            if 'Country' in self._data:
+                self._data['Country'], self._unmapped['Country'] = _map_column(self._data['Country'], country_map['Name'])
+            if 'Bloomberg' in self._data:
+                self._data['intRating'], self._unmapped['intRating'] = _map_column(self._data['Bloomberg'], rating_map['Score'])
+            #self._data['Credit type'], _ = _map_column(self._data['Bloomberg'], rating_map['Credit type'])
+            #self._data['Credit description'], _ = _map_column(self._data['Bloomberg'], rating_map['Credit description'])
             _logger.info('Mapping table loaded')
-        except:
-            _logger.warn('Mapping table not loaded. Going on')
+
+            for k, v in self._unmapped.items():
+                if v:
+                    _logger.warn('{} value(s) without mapping for {} (set to NaN)'.format(v, k))
+
+        self.check_cancelled()
+
+        # store each column with the dtype matching its declared value_type
+        memory_before = self._data.memory_usage(deep=True).sum()
+        self._data = _apply_schema(self._data, self._schema)
+        memory_after = self._data.memory_usage(deep=True).sum()
+        _logger.info('Data memory: {:.1f} MB -> {:.1f} MB'.format(memory_before / 1e6, memory_after / 1e6))
+
+        # new dataset: previously computed matrices are outdated
+        self._invalidate_matrix_cache()
 
         
     
+    def refresh(self):
+        """
+        Fetch again the volatile fields of the securities already loaded, and
+        return an updated copy of the dataset (aligned on ID). The model is
+        left untouched: the copy is swapped in by `apply_refresh`, on the
+        thread computing the matrices. Must be called after `run`.
+        Raises RunCancelled if `cancel` is called meanwhile.
+        Returns : the updated dataset, and the list of the columns whose values changed
+        """
+        self._init_bql()
+
+        data = self._data
+        fields = [k for k in self._options_list if k in self.__volatile_fields__]
+        if not fields or data.empty:
+            return data, []
+
+        _logger.info('Refreshing market data...')
+        factor_items = self._build_factors(user_selection=fields)
+        fresh = self._get_data_chunked(list(data.index), factor_items)
+        self.check_cancelled()
+
+        # securities missing from the response (failed requests) keep their values
+        common = fresh.index.intersection(data.index)
+        changed = []
+        for k in factor_items.keys():
+            if k not in fresh:
+                continue
+            column = data[k].copy()
+            column.loc[common] = fresh.loc[common, k].astype(column.dtype)
+            if not column.equals(data[k]):
+                if not changed:
+                    data = data.copy()
+                data[k] = column
+                changed.append(k)
+
+        _logger.info('{} field(s) updated'.format(len(changed)))
+        return data, changed
+
+    def apply_refresh(self, data, changed):
+        """
+        Swap in the dataset returned by `refresh`. Only the matrices built on
+        a changed column are dropped from the cache.
+        Inputs:
+        - data (DataFrame): dataset returned by `refresh`
+        - changed (list): columns whose values changed
+        """
+        self._data = data
+        self._data_version += 1
+        self._matrix_cache = OrderedDict(((x, y, self._data_version), v) for (x, y, _), v in self._matrix_cache.items()
+                                         if x not in changed and y not in changed)
+
     def get_model_data(self):
         return self._data
 
@@ -90,10 +348,54 @@ class PortfolioMonitorModel(object):
     def get_fields_list(self):
         return self._options_list
 
+    def get_fetch_report(self):
+        return [dict(r) for r in self._fetch_report]
+
+    def get_unmapped_counts(self):
+        return dict(self._unmapped)
+
+    def get_matrix_cache_stats(self):
+        return {'hits': self._matrix_cache_hits,
+                'misses': self._matrix_cache_misses,
+                'size': len(self._matrix_cache)}
+
+    def _invalidate_matrix_cache(self):
+        """Drop the cached matrices. To be called each time `self._data` changes."""
+        self._data_version += 1
+        self._matrix_cache.clear()
+
+    @timing.timed('model.set_data_as_matrix')
     def set_data_as_matrix(self, x, y):
         '''
         Summary: returns a table in 2-dim with data transformed and 
-        aggregated by bucket_type and by maturity.
+        aggregated by bucket_type and by maturity. Results are cached
+        (with their bin edges) until the data of the model changes.
+        Inputs:
+            - x (int): type of numerical value used to bucket the data
+            - y (str): type of bucket used to aggregated data on 
+                        (eg. Sector, or Country).
+        '''
+        key = (x, y, self._data_version)
+        if key in self._matrix_cache:
+            self._matrix_cache_hits += 1
+            self._matrix_cache.move_to_end(key)
+            return self._matrix_cache[key][0]
+
+        self._matrix_cache_misses += 1
+        df_matrix_x_y, bins_ = self._compute_matrix(x, y)
+
+        # failed computations (no bins) are not kept
+        if bins_:
+            self._matrix_cache[key] = (df_matrix_x_y, bins_)
+            if len(self._matrix_cache) > self.__matrix_cache_size__:
+                self._matrix_cache.popitem(last=False)
+
+        return df_matrix_x_y
+
+    def _compute_matrix(self, x, y):
+        '''
+        Summary: returns a table in 2-dim with data transformed and 
+        aggregated by bucket_type and by maturity, along with the bins.
         Inputs:
             - data (pd.DataFrame): initial dataframe. This df needs to 
             possess 2 mandatory columns: `x` (in numerical value) and 
@@ -117,30 +419,26 @@ class PortfolioMonitorModel(object):
 
             return bins
         
+        bucket_list = []
         try:
             # retrieve unique list of items for y-axis
-            bucket_list = sorted(self._data[y].unique())
+            bucket_list = sorted(self._data[y].dropna().unique())
 
             # retrieve the bins used in x-axis
             bins_ = _get_bin_hedges(self._data[x])
-            
+
+            # count all the (bucket, bin) pairs in one pass
+            counts = _count_in_bins(self._data[y], self._data[x], bucket_list, bins_)
+
             # create the final dataframe
-            df_matrix_x_y = pd.DataFrame(index=bucket_list,columns=bins_)
-            
-            # parse each bucket and assign each bins data
-            for s in bucket_list:
-                section_data = self._data[self._data[y] == s]
-                for b in bins_:
-                    selected_subset = section_data[x].between(b[0],b[1])
-                    df_matrix_x_y[b].loc[s] = section_data[selected_subset][y].count()
-            
+            df_matrix_x_y = pd.DataFrame(counts, index=bucket_list, columns=bins_)
             df_matrix_x_y.replace(0, np.nan, inplace=True)
 
-            return df_matrix_x_y
+            return df_matrix_x_y, bins_
             
         except Exception as e:
             _logger.error('Error in clustering data for {} (missing data points) - {}'.format(y, e))
-            return pd.DataFrame(index=bucket_list)
+            return pd.DataFrame(index=bucket_list), []
 
     
     def _build_univ(self):
@@ -157,11 +455,7 @@ class PortfolioMonitorModel(object):
 
         elif self._univ_type == 'List':
             if self._univ_value:
-                # Drop any line containing garbage character
-                tickers = [c.strip() for c in self._univ_value.splitlines() if c.isprintable()]
-                # bug-fix DRQS 113960117: need to input only 8-char tickers
-                tickers = ['{} {}'.format(t.split(' ')[0][:-1], t.split(' ')[1]) for t in tickers if len(t)>1]
-                return self._bq.univ.list(tickers)
+                return self._bq.univ.list(self._parse_tickers())
             else:
                 _logger.error('Error in selecting {} values... Check inputs again'.format(self._univ_type))
 
@@ -169,6 +463,14 @@ class PortfolioMonitorModel(object):
             _logger.error('What has been requested has not been implemented')
 
 
+    def _parse_tickers(self):
+        """Return the list of tickers input by the user for a 'List' universe."""
+        # Drop any line containing garbage character
+        tickers = [c.strip() for c in self._univ_value.splitlines() if c.isprintable()]
+        # bug-fix DRQS 113960117: need to input only 8-char tickers
+        return ['{} {}'.format(t.split(' ')[0][:-1], t.split(' ')[1]) for t in tickers if len(t)>1]
+
+
     def _build_factors(self, user_selection):
         """
         Construct the factors for a portfolio monitor
@@ -200,6 +502,7 @@ class PortfolioMonitorModel(object):
         return final_factors_list
     
 
+    @timing.timed('model.get_data')
     def _get_data(self, universe, bql_factors):
         """
         Retrieve data model based on the universe and the BQL items
@@ -212,45 +515,273 @@ class PortfolioMonitorModel(object):
         # request data to BQL
         try:
             self._debug_query = bql.Request(universe, bql_factors)
-            r = self._bq.execute(bql.Request(universe, bql_factors))
-
-            # store the whole dataset in data
-            data = pd.DataFrame()
-            # capture each dataset from the response
-            # by using the keys of the bql_factors
-            for k in bql_factors.keys():
-                temp = r.get(k).df()[k]
-                
-                # transform the series type to float when applicable
-                if k in set(self._float_fields_only):
-                    temp.dropna().astype('float64')
-
-                data = pd.concat([data, temp], join='outer', axis=1)
-
+            data = self._fetch(universe, bql_factors, cache_key='{}|{}'.format(self._univ_type, self._univ_value))
+            self._fetch_report = [{'chunk': 0, 'securities': len(data), 'attempts': 1, 'status': 'ok', 'error': None}]
 
         except Exception as e:
             _logger.error('Error while fetching data ({})'.format(e))
+            self._fetch_report = [{'chunk': 0, 'securities': None, 'attempts': 1, 'status': 'failed', 'error': str(e)}]
             data = pd.DataFrame()
 
         return data
+
+    def _fetch(self, universe, bql_factors, cache_key):
+        """
+        Retrieve the bql_factors on the universe, split into groups (reference,
+        market data, heavy market data) requested concurrently. Reference
+        fields are only requested for the securities missing or expired in
+        the reference cache. Errors are raised.
+        Inputs:
+        - universe (bqlItem object): bql universe item object
+        - bql_factors (dict): bql data item object to request data on
+        - cache_key (str): identifies the universe in the reference cache
+        """
+        static, market, heavy = OrderedDict(), OrderedDict(), OrderedDict()
+        for k, v in bql_factors.items():
+            group = static if k in self._ttls else heavy if k in self.__heavy_fields__ else market
+            group[k] = v
+
+        cache = self._get_reference_cache() if static else None
+        members = cache.get_members(cache_key) if cache is not None else None
+
+        # reference fields go with the other groups until the members are known
+        groups = [g for g in (market, heavy) if g]
+        if static and members is None:
+            groups.append(static)
+        elif static and not groups:
+            # reference fields only: resolve the universe anyway (IDs only),
+            # so that the securities which joined or left it are picked up
+            groups.append(OrderedDict([('ID', self._bq.data.id())]))
+
+        with ThreadPoolExecutor(max_workers=len(groups) + 1) as pool:
+            futures = [pool.submit(self._execute, bql.Request(universe, g), g) for g in groups]
+            if static and members is not None:
+                static_future = pool.submit(self._fetch_static, members, static, cache)
+            # any failed group fails the whole fetch
+            frames = [f.result() for f in futures]
+
+        data = pd.concat(frames, join='outer', axis=1) if frames else pd.DataFrame()
+
+        if static and members is not None:
+            parts = [static_future.result()]
+            # securities which joined the universe since the last run
+            known = set(members)
+            new_ids = [i for i in data.index if i not in known]
+            if new_ids:
+                parts.append(self._fetch_static(new_ids, static, cache))
+            static_data = pd.concat(parts, axis=0)
+            static_data = static_data[~static_data.index.duplicated()]
+            data = pd.concat([data, static_data.reindex(data.index)], axis=1)
+
+        elif cache is not None:
+            cache.put(data[list(static.keys())])
+
+        if cache is not None:
+            cache.set_members(cache_key, list(data.index))
+
+        # keep the order of the factors
+        return data[[k for k in bql_factors.keys() if k in data]]
+
+    def _fetch_static(self, ids, static, cache):
+        """Return the reference fields of the securities `ids`, reading the
+        cache first and requesting only what is missing or expired."""
+        data, missing = cache.get(ids, {k: self._ttls[k] for k in static.keys()})
+        fields = [k for k in static.keys() if missing[k]]
+        if not fields:
+            _logger.debug('Reference data read from cache ({} securities)'.format(len(ids)))
+            return data
+
+        ids_missing = set()
+        for k in fields:
+            ids_missing.update(missing[k])
+        to_request = [i for i in ids if i in ids_missing]
+        _logger.debug('Requesting reference data for {}/{} securities'.format(len(to_request), len(ids)))
+
+        items = OrderedDict((k, static[k]) for k in fields)
+        fetched = self._execute(bql.Request(self._bq.univ.list(to_request), items), items)
+        cache.put(fetched)
+
+        data.update(fetched)
+        return data
+
+    def _get_reference_cache(self):
+        """Open the shared reference cache lazily (None if not available)."""
+        if PortfolioMonitorModel.__reference_cache__ is None:
+            try:
+                cache = ReferenceCache(self.__reference_cache_path__)
+                cache.prune(self.__universe_cache_days__ * 86400.)
+                PortfolioMonitorModel.__reference_cache__ = cache
+            except Exception as e:
+                _logger.warn('Reference cache not available, fetching everything ({})'.format(e))
+                return None
+
+        return PortfolioMonitorModel.__reference_cache__
+
+    def _execute(self, request, bql_factors):
+        """
+        Execute a BQL request and return its response as a DataFrame
+        (one column per key of bql_factors). Errors are raised.
+        """
+        r = self._bq.execute(request)
+
+        # capture each dataset from the response
+        # by using the keys of the bql_factors
+        float_fields = set(self._float_fields_only)
+        columns = []
+        for k in bql_factors.keys():
+            temp = r.get(k).df()[k]
+
+            # transform the series type to float when applicable
+            if k in float_fields:
+                temp = pd.to_numeric(temp, errors='coerce').astype('float64')
+
+            columns.append(temp)
+
+        # align all the columns at once to store the whole dataset in data; the
+        # index is left unnamed (as the former concat onto an empty frame did),
+        # so that the tables of the app get the securities as an 'index' column
+        return pd.concat(columns, join='outer', axis=1).rename_axis(None) if columns else pd.DataFrame()
+
+    def _get_data_chunked(self, tickers, bql_factors):
+        """
+        Retrieve data model on a list of tickers, split in chunks of
+        `__fetch_chunk_size__` securities requested concurrently when there
+        are more than `__fetch_chunk_min__`. A failed chunk is retried
+        `__fetch_retries__` times; chunks still failing are left out of the
+        result and reported in `get_fetch_report()`.
+        Inputs:
+        - tickers (list): securities to request data on
+        - bql_factors (dict): bql data item object to request data on
+        """
+        self._debug_query = bql.Request(self._bq.univ.list(tickers), bql_factors)
+
+        size = max(1, len(tickers) if len(tickers) <= self.__fetch_chunk_min__ else int(self.__fetch_chunk_size__))
+        chunks = [tickers[i:i + size] for i in range(0, len(tickers), size)]
+
+        def _fetch_chunk(i):
+            report = {'chunk': i, 'securities': len(chunks[i]), 'attempts': 0, 'status': 'failed', 'error': None}
+            for attempt in range(self.__fetch_retries__ + 1):
+                self.check_cancelled()
+                report['attempts'] = attempt + 1
+                try:
+                    data = self._fetch(self._bq.univ.list(chunks[i]), bql_factors,
+                                       cache_key='List|{}'.format(hashlib.sha1('\n'.join(chunks[i]).encode()).hexdigest()))
+                    report['status'] = 'ok' if attempt == 0 else 'recovered'
+                    return data, report
+                except Exception as e:
+                    report['error'] = str(e)
+                    if attempt < self.__fetch_retries__:
+                        time.sleep(self.__fetch_backoff__ * 2 ** attempt)
+            return None, report
+
+        if len(chunks) > 1:
+            _logger.info('Fetching {} securities in {} requests...'.format(len(tickers), len(chunks)))
+
+        with ThreadPoolExecutor(max_workers=max(1, self.__fetch_max_workers__)) as pool:
+            futures = [pool.submit(_fetch_chunk, i) for i in range(len(chunks))]
+            results = [f.result() for f in futures]
+
+        # merge the chunks in the order of the input list
+        self._fetch_report = [report for _, report in results]
+        frames = [df for df, _ in results if df is not None]
+        for report in self._fetch_report:
+            if report['status'] == 'failed':
+                _logger.error('Request {}/{} ({} securities) failed after {} attempt(s) ({})'.format(
+                    report['chunk'] + 1, len(chunks), report['securities'], report['attempts'], report['error']))
+            elif report['status'] == 'recovered':
+                _logger.warn('Request {}/{} ({} securities) succeeded after {} attempt(s)'.format(
+                    report['chunk'] + 1, len(chunks), report['securities'], report['attempts']))
+
+        return pd.concat(frames, axis=0) if frames else pd.DataFrame()
     
+    def prefetch_history(self, ids, fields, history_period='-1y'):
+        """Fetch in one request the history of several fields into the history
+        store, so that later reads are served locally."""
+        with self._history_lock:
+            for start, (plan_ids, plan_fields, since, today) in self._plan_history(ids, fields, history_period).items():
+                self._fetch_history(list(plan_ids), list(plan_fields), start, since, today)
+
+    def history_missing(self, ids, fields, history_period='-1y'):
+        """Return True if some history of `fields` is not in the store yet
+        (or is out of date), ie. if `prefetch_history` would send a request."""
+        return bool(self._plan_history(ids, fields, history_period))
+
+    def _plan_history(self, ids, fields, history_period):
+        """Group what needs to be requested by start date.
+        Returns : dict start -> (IDs, fields, first date requested, today)"""
+        today = pd.Timestamp.today().normalize()
+        first_date = _period_start(history_period, today)
+        store = self._get_history_store()
+
+        plan = OrderedDict()
+        for f in fields:
+            coverage = store.coverage(f, ids)
+            for i in ids:
+                since, fetched = coverage.get(i, (None, None))
+                if since is None or pd.isnull(since) or since > first_date:
+                    start = history_period
+                elif fetched < today:
+                    start = fetched.strftime('%Y-%m-%d')
+                else:
+                    continue
+                since = first_date if start == history_period else pd.Timestamp(start)
+                plan_ids, plan_fields, _, _ = plan.setdefault(start, (OrderedDict(), OrderedDict(), since, today))
+                plan_ids[i] = None
+                plan_fields[f] = None
+        return plan
+
+    def get_history_window(self, ids, field_name, history_period='-1y'):
+        """
+        Read the time series of a field from the history store, fetching what
+        is missing first.
+        Returns : dates (datetime64 array), IDs found, and values as a
+        (dates x IDs) float64 array, copied from the store.
+        """
+        self.prefetch_history(ids, [field_name], history_period)
+        return self.read_history_window(ids, field_name, history_period)
+
+    def read_history_window(self, ids, field_name, history_period='-1y'):
+        """Same as `get_history_window`, from what is in the history store only
+        (never sends a request)."""
+        first_date = _period_start(history_period, pd.Timestamp.today().normalize())
+        return self._get_history_store().window(field_name, ids, start=max(first_date, pd.Timestamp('1900-01-01')))
+
+    @timing.timed('model.get_history')
     def _get_history(self, ids, field_name, history_period='-1y'):
-        # get the field in bql_item
-        bql_item = self._build_factors(user_selection=field_name)
+        """
+        Retrieve the time series of a field, pivoted by date (rows) and
+        security (columns). Served from the history store when available.
+        """
+        dates, found, values = self.get_history_window(ids, field_name, history_period)
+        data = pd.DataFrame(values, index=pd.DatetimeIndex(dates.astype('datetime64[ns]'), name='DATE'),
+                            columns=pd.Index(found, name='ID'))
+        # drop the dates and securities without any value, as a pivot would
+        return data.dropna(how='all').dropna(how='all', axis=1)
+
+    def _get_history_store(self):
+        """Open the shared history store lazily."""
+        if PortfolioMonitorModel.__history_store__ is None:
+            PortfolioMonitorModel.__history_store__ = TimeSeriesStore(self.__history_store_path__)
+        return PortfolioMonitorModel.__history_store__
+
+    def _fetch_history(self, ids, fields, start, since, today):
+        """Request the history of the fields since `start` and write it in the store."""
+        # get the fields in bql_item
+        bql_items = self._build_factors(user_selection=fields)
+        store = self._get_history_store()
         try:
-            r = self._bq.execute(bql.Request(ids, bql_item, with_params={'start':history_period}))
+            r = self._bq.execute(bql.Request(ids, bql_items, with_params={'start': start}))
 
-            # store the whole dataset in data
-            data = r.single().df()
-
-            # pivot the data for better display
-            data = data.reset_index().pivot_table(index='DATE', columns='ID', values=field_name)
+            for f in bql_items.keys():
+                # pivot the data per security
+                data = r.get(f).df().reset_index()
+                data[f] = pd.to_numeric(data[f], errors='coerce')
+                data = data.pivot_table(index='DATE', columns='ID', values=f)
+                data.index = pd.to_datetime(data.index)
 
+                # keep the requested order of the securities, so that they are
+                # stored side by side
+                store.update(f, data.reindex(columns=ids), since=since, fetched=today)
 
         except Exception as e:
             _logger.error('Error while fetching timeseries ({})'.format(e))
-            data = pd.DataFrame()
-
-        return data
-
-   
\ No newline at end of file
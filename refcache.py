@@ -0,0 +1,145 @@
+"""
+Persistent cache of the reference (static) fields of securities.
+
+Values are stored in a local SQLite file, one row per (security ID, field)
+with the time they were fetched, so that a Run only requests from BQL the
+securities and fields that are missing or older than their time-to-live.
+The last known members of each universe are stored as well, which allows
+planning the requests before the universe is resolved by BQL; universes not
+used for a while are dropped by `prune`.
+"""
+import json
+import contextlib
+import sqlite3
+import threading
+import time
+import datetime
+
+import numpy as np
+import pandas as pd
+
+
+def _encode(value):
+    """JSON text of a value (None for a missing value)."""
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value)
+    if pd.isnull(value):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime.date, np.datetime64)):
+        return json.dumps(pd.Timestamp(value).isoformat())
+    if isinstance(value, np.generic):
+        value = value.item()
+    return json.dumps(value)
+
+
+def _decode(text):
+    return None if text is None else json.loads(text)
+
+
+class ReferenceCache(object):
+    """Store of field values per security, backed by a SQLite file."""
+
+    # time-to-live (seconds) of a missing value, shorter than the one of its
+    # field so that a value not published yet is requested again soon
+    __missing_ttl__ = 3600.
+
+    # IDs bound per statement when inserting the IDs read by `get`
+    __batch_size__ = 500
+
+    def __init__(self, path='reference_cache.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS reference ('
+                         'id TEXT, field TEXT, value TEXT, fetched REAL, PRIMARY KEY (id, field))')
+            conn.execute('CREATE TABLE IF NOT EXISTS universe ('
+                         'key TEXT, id TEXT, position INTEGER, PRIMARY KEY (key, id))')
+            conn.execute('CREATE TABLE IF NOT EXISTS universe_updated ('
+                         'key TEXT PRIMARY KEY, updated REAL)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one connection per call: the cache is used from several threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, ids, ttls):
+        """
+        Read the values still valid for the securities `ids`.
+        Inputs:
+            - ids (list): security IDs
+            - ttls (dict): field -> time-to-live in seconds
+        Returns : DataFrame indexed by ID with one column per field (NaN when
+        not cached or expired), and a dict field -> list of IDs to request.
+        """
+        index = pd.Index(ids, name='ID')
+        data = pd.DataFrame(index=index)
+        missing = dict()
+        now = time.time()
+
+        with self._connect() as conn:
+            # filter on the IDs requested in SQL, through a temporary table
+            # (dropped with the connection)
+            conn.execute('CREATE TEMP TABLE ids (id TEXT PRIMARY KEY)')
+            unique = list(dict.fromkeys(str(i) for i in ids))
+            for n in range(0, len(unique), self.__batch_size__):
+                conn.executemany('INSERT INTO ids (id) VALUES (?)', [(i,) for i in unique[n:n + self.__batch_size__]])
+
+            for field, ttl in ttls.items():
+                rows = conn.execute('SELECT r.id, r.value FROM reference r JOIN ids USING (id) '
+                                    'WHERE r.field = ? AND r.fetched >= ? AND (r.value IS NOT NULL OR r.fetched >= ?)',
+                                    (field, now - ttl, now - min(ttl, self.__missing_ttl__))).fetchall()
+                values = pd.Series(dict(rows), dtype=object)
+
+                data[field] = values.map(_decode).reindex(index)
+                missing[field] = list(index[~index.isin(values.index)])
+
+        return data, missing
+
+    def put(self, df):
+        """Store the values of every column of `df` (indexed by security ID)."""
+        now = time.time()
+        rows = [(str(i), field, _encode(v), now)
+                for field in df.columns for i, v in df[field].items()]
+
+        with self._lock, self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO reference (id, field, value, fetched) VALUES (?, ?, ?, ?)', rows)
+
+    def get_members(self, key):
+        """Last known members of the universe `key` (None if never stored)."""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT id FROM universe WHERE key = ? ORDER BY position', (key,)).fetchall()
+        return [r[0] for r in rows] if rows else None
+
+    def set_members(self, key, ids):
+        """Store the members of the universe `key`."""
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM universe WHERE key = ?', (key,))
+            conn.executemany('INSERT OR REPLACE INTO universe (key, id, position) VALUES (?, ?, ?)',
+                             [(key, str(i), n) for n, i in enumerate(ids)])
+            conn.execute('INSERT OR REPLACE INTO universe_updated (key, updated) VALUES (?, ?)', (key, time.time()))
+
+    def prune(self, max_age):
+        """Drop the members of the universes not stored for `max_age` seconds
+        (eg. the chunks of custom lists, keyed by a hash of their tickers).
+        Returns : the number of universes dropped"""
+        cutoff = time.time() - max_age
+        with self._lock, self._connect() as conn:
+            keys = [r[0] for r in conn.execute(
+                'SELECT DISTINCT key FROM universe WHERE key NOT IN '
+                '(SELECT key FROM universe_updated WHERE updated >= ?)', (cutoff,)).fetchall()]
+            conn.execute('DELETE FROM universe WHERE key NOT IN '
+                         '(SELECT key FROM universe_updated WHERE updated >= ?)', (cutoff,))
+            conn.execute('DELETE FROM universe_updated WHERE updated < ?', (cutoff,))
+        return len(keys)
+
+    def clear(self):
+        """Drop every cached value and universe."""
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM reference')
+            conn.execute('DELETE FROM universe')
+            conn.execute('DELETE FROM universe_updated')
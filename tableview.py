@@ -0,0 +1,181 @@
+"""
+Kernel-side view of the Data table tab.
+
+The table data stays numerical: the '-' shown for the missing values is only
+rendered for the rows sent to the grid. Filters and the lasso selection are
+kept as boolean visibility masks over the rows: a change of selection is
+resolved into the rows added and removed, and the grid is only updated when
+the visible rows actually changed. Sorting is done here as well, and the grid
+only receives one page of the visible rows at a time.
+"""
+import numpy as np
+import pandas as pd
+
+
+def fill_for_display(df):
+    """Copy of `df` with the missing values displayed as '-'."""
+    df = df.copy()
+    # a categorical column only accepts one of its categories as a fill value
+    for c in df.select_dtypes(include=['category']).columns:
+        if '-' not in df[c].cat.categories:
+            df[c] = df[c].cat.add_categories('-')
+    return df.fillna('-')
+
+
+def render_tooltips(df, columns):
+    """HTML tooltip of each row of `df`: one line per column of `columns`."""
+    html = pd.Series('', index=df.index, dtype=object)
+    for c in columns:
+        html = html + '<p><span style="font-weight:bold; color:dimgrey;">{}: </span> <span>'.format(c) \
+                    + df[c].astype(str) + '</span></p>'
+    return html.values
+
+
+class TableView(object):
+    """
+    Rows of a table, with the filter and the brush (lasso) masks applied.
+    Parameters
+    ----------
+    data: pd.DataFrame
+        the full table, one row per security
+    """
+
+    def __init__(self, data):
+        self.data = data.reset_index(drop=True)
+        self._filter = np.ones(len(self.data), dtype=bool)
+        self._brush = None
+        self._order = np.arange(len(self.data))
+        self._sort = (None, True)
+        self._tooltips = None
+
+    def __len__(self):
+        return int(self.visible_mask().sum())
+
+    def visible_mask(self):
+        """Rows displayed in the grid: filtered, then brushed if any."""
+        return self._filter if self._brush is None else self._filter & self._brush
+
+    def _apply(self, update):
+        before = self.visible_mask()
+        update()
+        after = self.visible_mask()
+        return np.flatnonzero(after & ~before), np.flatnonzero(before & ~after)
+
+    def set_filter(self, mask):
+        """
+        Set the rows selected by the filters (the brush is cleared).
+        Returns : positions of the rows added and of the rows removed
+        """
+        def update():
+            self._filter = np.asarray(mask, dtype=bool)
+            self._brush = None
+        return self._apply(update)
+
+    def set_brush(self, mask):
+        """Set the rows selected by the lasso (None to clear it), on top of the
+        filters. Returns : positions of the rows added and of the rows removed"""
+        def update():
+            self._brush = None if mask is None else np.asarray(mask, dtype=bool)
+        return self._apply(update)
+
+    def filtered(self):
+        """Rows selected by the filters (numerical data, not rendered)."""
+        return self.data[self._filter].reset_index(drop=True)
+
+    def update_columns(self, data, columns):
+        """Replace the values of `columns` (same rows and order as the table)."""
+        for c in columns:
+            self.data[c] = np.asarray(data[c])
+        self._tooltips = None
+        if self._sort[0] in columns:
+            self.set_sort(*self._sort)
+
+    def prepare_tooltips(self, exclude=()):
+        """Render the HTML tooltips of all the rows, unless they are already
+        rendered for the current data and the columns `exclude`d."""
+        exclude = tuple(exclude)
+        if self._tooltips is None or self._tooltips[0] != exclude:
+            columns = [c for c in self.data.columns if c not in exclude]
+            self._tooltips = (exclude, render_tooltips(fill_for_display(self.data), columns))
+
+    def tooltip(self, row, exclude=()):
+        """HTML tooltip of the row at position `row` in the table (rendered by
+        `prepare_tooltips` if needed)."""
+        self.prepare_tooltips(exclude)
+        return self._tooltips[1][row]
+
+    def set_sort(self, column=None, ascending=True):
+        """Sort the rows on the values of `column` (table order if None),
+        missing values last."""
+        self._sort = (column, ascending)
+        if column is None:
+            self._order = np.arange(len(self.data))
+        else:
+            ordered = self.data[column].sort_values(ascending=ascending, na_position='last', kind='stable')
+            self._order = self.data.index.get_indexer(ordered.index)
+
+    def visible_rows(self):
+        """Positions (in the table) of the visible rows, in sort order."""
+        return self._order[self.visible_mask()[self._order]]
+
+    def page(self, start, count):
+        """
+        Window of the visible rows, in sort order.
+        Returns : the rows rendered for display, and their positions in the table
+        """
+        rows = self.visible_rows()[start:start + count]
+        return fill_for_display(self.data.iloc[rows].reset_index(drop=True)), rows
+
+
+class CategoryIndex(object):
+    """
+    Row bitmaps of each value of categorical columns, built once per Run, so
+    that any combination of filter selections resolves with bitwise OR (within
+    a column) and AND (across columns) instead of scanning the table.
+    Parameters
+    ----------
+    data: pd.DataFrame
+        the full table
+    columns: list
+        categorical columns to index
+    """
+
+    def __init__(self, data, columns):
+        self._n_rows = len(data)
+        self._labels = dict()
+        self._bitmaps = dict()
+        self._not_null = dict()
+
+        for c in columns:
+            codes, labels = pd.factorize(data[c], sort=True)
+            # one packed bitmap (8 rows per byte) per value of the column
+            bits = codes[None, :] == np.arange(len(labels))[:, None]
+            self._labels[c] = {label: k for k, label in enumerate(labels)}
+            self._bitmaps[c] = np.packbits(bits, axis=1)
+            self._not_null[c] = np.packbits(codes >= 0)
+
+    def columns(self):
+        return list(self._labels)
+
+    def options(self, column):
+        """Sorted values of `column` (missing values excluded)."""
+        return list(self._labels[column])
+
+    def mask(self, selections):
+        """
+        Rows matching the selections.
+        Inputs:
+            - selections (dict): column -> values selected
+        Returns : boolean array, one item per row of the table
+        """
+        bitmap = np.full((self._n_rows + 7) // 8, 0xFF, dtype='uint8')
+        for c, values in selections.items():
+            codes = [self._labels[c][v] for v in values if v in self._labels[c]]
+            if len(codes) == len(self._labels[c]):
+                # every value selected: only the missing values are excluded
+                bitmap &= self._not_null[c]
+            elif codes:
+                bitmap &= np.bitwise_or.reduce(self._bitmaps[c][codes], axis=0)
+            else:
+                bitmap[:] = 0
+        return np.unpackbits(bitmap, count=self._n_rows).astype(bool)
@@ -0,0 +1,291 @@
+"""
+Columnar store of the time series fetched for the Model Portfolio tab.
+
+Each field is kept as one dense float64 array of (dates x securities), with
+the sorted dates and a map security ID -> column. New dates are appended at
+the bottom and new securities at the right, inside a capacity that grows by
+doubling, so that an incremental fetch does not copy what is already stored.
+Reads return a copy of the window requested, made under the lock of the store:
+the arrays can be grown (and their files replaced) at any time.
+
+When created with a directory, the arrays are memory-mapped files in it
+(one `<field>.f64` file plus a `<field>.json` index per field), so that long
+histories on large universes are kept on disk rather than in pandas frames,
+and survive the kernel.
+"""
+import os
+import re
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+_MIN_CAPACITY = 64
+
+
+def _file_name(field):
+    return re.sub(r'\W+', '_', field).strip('_') or 'field'
+
+
+def _to_days(dates):
+    return pd.DatetimeIndex(dates).values.astype('datetime64[D]')
+
+
+def _close(values):
+    """Flush and unmap a memmap, so that its file can be replaced (Windows
+    does not allow it while the file is mapped). `values` is unusable after."""
+    mapping = getattr(values, '_mmap', None)
+    if mapping is not None:
+        values.flush()
+        mapping.close()
+
+
+def downsample_minmax(dates, values, n_buckets):
+    """
+    Reduce series sharing the same dates to at most 2 points per bucket of
+    consecutive dates: the min and the max of each series in the bucket, in
+    date order. Spikes stay visible however many points are dropped.
+    Inputs:
+        - dates (array): sorted dates, length n
+        - values (array): (n x series) values
+        - n_buckets (int): number of buckets, typically the chart width in pixels
+    Returns : x and y arrays of shape (series x points), the x differing per series.
+    """
+    values = np.asarray(values, dtype='float64')
+    n, n_series = values.shape
+    if n <= 2 * n_buckets:
+        return np.tile(dates, (n_series, 1)), values.T
+
+    # buckets of equal size, the last one padded
+    size = -(-n // n_buckets)
+    n_buckets = -(-n // size)
+    padded = np.full((n_buckets * size, n_series), np.nan)
+    padded[:n] = values
+    padded = padded.reshape(n_buckets, size, n_series)
+
+    # position of the min and the max in each bucket, missing values ignored
+    low = np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    high = np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+    offset = (np.arange(n_buckets) * size)[:, None]
+    rows = np.stack([np.minimum(low, high), np.maximum(low, high)], axis=1) + offset[:, None, :]
+    rows = np.minimum(rows.reshape(2 * n_buckets, n_series), n - 1)
+
+    y = np.take_along_axis(values, rows, axis=0)
+    return np.asarray(dates)[rows].T, y.T
+
+
+class _FieldBlock(object):
+    """Dense array of one field, with its index of dates and securities."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.dates = np.empty(0, dtype='datetime64[D]')
+        self.ids = []
+        self.slots = dict()
+        # per security: first date requested and date of the last fetch
+        self.since = np.empty(0, dtype='datetime64[D]')
+        self.fetched = np.empty(0, dtype='datetime64[D]')
+        # stored arrays are opened as they are: allocating first would truncate their file
+        if path is not None and os.path.exists(path + '.json'):
+            self._load()
+        else:
+            self.values = self._allocate(_MIN_CAPACITY, _MIN_CAPACITY)
+
+    # -- storage --------------------------------------------------------------
+
+    def _allocate(self, n_dates, n_ids, suffix=''):
+        if self.path is None:
+            values = np.empty((n_dates, n_ids), dtype='float64')
+        else:
+            values = np.memmap(self.path + '.f64' + suffix, dtype='float64', mode='w+', shape=(n_dates, n_ids))
+        values[:] = np.nan
+        return values
+
+    def _reserve(self, n_dates, n_ids):
+        """Make room for `n_dates` x `n_ids` values, keeping the ones stored."""
+        cap_dates, cap_ids = self.values.shape
+        if n_dates <= cap_dates and n_ids <= cap_ids:
+            return
+
+        while cap_dates < n_dates:
+            cap_dates *= 2
+        while cap_ids < n_ids:
+            cap_ids *= 2
+
+        values = self._allocate(cap_dates, cap_ids, suffix='.tmp')
+        values[:len(self.dates), :len(self.ids)] = self.values[:len(self.dates), :len(self.ids)]
+        self._replace(values)
+
+    def _replace(self, values):
+        if self.path is not None:
+            # both files are unmapped before the new one takes the place of the old one
+            shape = values.shape
+            _close(values)
+            _close(self.values)
+            self.values = None
+            os.replace(self.path + '.f64.tmp', self.path + '.f64')
+            values = np.memmap(self.path + '.f64', dtype='float64', mode='r+', shape=shape)
+        self.values = values
+
+    def _load(self):
+        with open(self.path + '.json') as f:
+            meta = json.load(f)
+        self.dates = np.array(meta['dates'], dtype='int64').astype('datetime64[D]')
+        self.ids = list(meta['ids'])
+        self.slots = {i: n for n, i in enumerate(self.ids)}
+        self.since = np.array(meta['since'], dtype='int64').astype('datetime64[D]')
+        self.fetched = np.array(meta['fetched'], dtype='int64').astype('datetime64[D]')
+        self.values = np.memmap(self.path + '.f64', dtype='float64', mode='r+', shape=tuple(meta['shape']))
+
+    def flush(self):
+        if self.path is None:
+            return
+        self.values.flush()
+        meta = {'shape': list(self.values.shape),
+                'dates': self.dates.astype('int64').tolist(),
+                'ids': self.ids,
+                'since': self.since.astype('int64').tolist(),
+                'fetched': self.fetched.astype('int64').tolist()}
+        with open(self.path + '.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(self.path + '.json.tmp', self.path + '.json')
+
+    # -- updates --------------------------------------------------------------
+
+    def add_securities(self, ids):
+        new = [i for i in dict.fromkeys(ids) if i not in self.slots]
+        if not new:
+            return
+        self._reserve(len(self.dates), len(self.ids) + len(new))
+        for i in new:
+            self.slots[i] = len(self.ids)
+            self.ids.append(i)
+        nat = np.full(len(new), np.datetime64('NaT'), dtype='datetime64[D]')
+        self.since = np.concatenate([self.since, nat])
+        self.fetched = np.concatenate([self.fetched, nat])
+
+    def add_dates(self, dates):
+        """Insert the dates not stored yet; returns the row of each of `dates`."""
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        new = np.setdiff1d(dates, self.dates)
+
+        if len(new):
+            n = len(self.dates)
+            if n == 0 or new[0] > self.dates[-1]:
+                # usual case: later dates, appended at the bottom
+                self._reserve(n + len(new), len(self.ids))
+                self.values[n:n + len(new), :len(self.ids)] = np.nan
+                self.dates = np.concatenate([self.dates, new])
+            else:
+                # earlier or missing dates: rebuild the array in date order
+                merged = np.union1d(self.dates, new)
+                cap_dates, cap_ids = self.values.shape
+                while cap_dates < len(merged):
+                    cap_dates *= 2
+                values = self._allocate(cap_dates, cap_ids, suffix='.tmp')
+                values[np.searchsorted(merged, self.dates), :len(self.ids)] = self.values[:n, :len(self.ids)]
+                self._replace(values)
+                self.dates = merged
+
+        return np.searchsorted(self.dates, dates)
+
+    def update(self, data, since, fetched):
+        """Write the non-null values of `data` (index: dates, columns: IDs)."""
+        self.add_securities(list(data.columns))
+        rows = self.add_dates(_to_days(data.index))
+        cols = np.array([self.slots[i] for i in data.columns], dtype='int64')
+
+        block = data.to_numpy(dtype='float64', na_value=np.nan)
+        r, c = np.nonzero(~np.isnan(block))
+        self.values[rows[r], cols[c]] = block[r, c]
+
+        # a longer period than the stored one resets the first date covered
+        since = np.datetime64(since, 'D')
+        self.since[cols] = np.where(np.isnat(self.since[cols]) | (self.since[cols] > since), since, self.since[cols])
+        self.fetched[cols] = np.datetime64(fetched, 'D')
+
+    # -- reads ----------------------------------------------------------------
+
+    def window(self, ids, start=None):
+        """Dates from `start` and values (dates x ids, a copy) of the securities stored."""
+        ids = [i for i in ids if i in self.slots]
+        first = 0 if start is None else int(np.searchsorted(self.dates, np.datetime64(start, 'D')))
+        rows = slice(first, len(self.dates))
+
+        cols = [self.slots[i] for i in ids]
+        if cols and cols == list(range(cols[0], cols[0] + len(cols))):
+            # securities stored side by side: one slice copied
+            values = np.array(self.values[rows, cols[0]:cols[0] + len(cols)])
+        else:
+            values = self.values[rows][:, cols]
+
+        return self.dates[rows].copy(), ids, values
+
+
+class TimeSeriesStore(object):
+    """
+    Time series per field, stored as dense (dates x securities) arrays.
+    Parameters
+    ----------
+    path: str
+        optional directory where the arrays are memory-mapped. In memory if None.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._blocks = dict()
+        self._lock = threading.Lock()
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _block(self, field):
+        block = self._blocks.get(field)
+        if block is None:
+            path = None if self.path is None else os.path.join(self.path, _file_name(field))
+            block = self._blocks[field] = _FieldBlock(path)
+        return block
+
+    def update(self, field, data, since, fetched):
+        """
+        Store the values of a field.
+        Inputs:
+            - field (str): name of the field
+            - data (DataFrame): values, indexed by date with one column per security
+            - since (date): first date of the period requested for these securities
+            - fetched (date): date of the request
+        """
+        with self._lock:
+            block = self._block(field)
+            block.update(data, since, fetched)
+            block.flush()
+
+    def coverage(self, field, ids):
+        """Return a dict ID -> (first date covered, date of the last fetch) for
+        the securities of `ids` stored for `field`."""
+        with self._lock:
+            block = self._block(field)
+            return {i: (pd.Timestamp(block.since[block.slots[i]]), pd.Timestamp(block.fetched[block.slots[i]]))
+                    for i in ids if i in block.slots}
+
+    def window(self, field, ids, start=None):
+        """
+        Read the values of a field.
+        Returns : the dates from `start` (datetime64 array), the IDs found among
+        `ids`, and the values as a (dates x IDs) float64 array. The array is
+        copied while the store is locked, so it never sees a block being grown.
+        """
+        with self._lock:
+            return self._block(field).window(ids, start)
+
+    def frame(self, field, ids, start=None):
+        """Same as `window`, as a DataFrame indexed by DATE with one column per ID."""
+        dates, found, values = self.window(field, ids, start)
+        return pd.DataFrame(values, index=pd.DatetimeIndex(dates.astype('datetime64[ns]'), name='DATE'),
+                            columns=pd.Index(found, name='ID'), copy=False)
+
+    def nbytes(self):
+        """Size of the arrays allocated, in bytes."""
+        with self._lock:
+            return sum(b.values.nbytes for b in self._blocks.values())
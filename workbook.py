@@ -0,0 +1,159 @@
+"""
+Shared loader for the Excel workbooks of the app (config.xlsx, mapping.xlsx).
+
+Sheets are parsed once per process. A binary sidecar of each workbook can be
+compiled beforehand, to skip the Excel parsing at kernel start:
+    python workbook.py config.xlsx mapping.xlsx
+The sidecar (eg. `config.xlsx.pkl`) is only used while the content hash it
+stores matches the workbook; otherwise the workbook is parsed as usual.
+"""
+import os
+import sys
+import hashlib
+import pickle
+import threading
+import time
+import logging
+
+import pandas as pd
+
+_logger = logging.getLogger('PortfolioMonitorDemo')
+
+# Parsed sheets shared across the process, keyed by (path, sheet, index_col)
+_cache = dict()
+_lock = threading.Lock()
+
+# History of the sheets actually parsed (cache misses)
+_load_timings = []
+
+# Sidecars loaded so far, keyed by workbook path: (signature, sheets or None)
+_sidecars = dict()
+
+SIDECAR_EXTENSION = '.pkl'
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size)
+
+
+def _content_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _sidecar_path(path):
+    return path + SIDECAR_EXTENSION
+
+
+def _get_sidecar_sheets(path, signature):
+    """Return the sheets stored in the sidecar of `path`, or None if there is
+    no sidecar or if it was compiled from another version of the workbook."""
+    entry = _sidecars.get(path)
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+
+    sheets = None
+    sidecar = _sidecar_path(path)
+    if os.path.exists(sidecar):
+        try:
+            with open(sidecar, 'rb') as f:
+                content = pickle.load(f)
+            if content['hash'] == _content_hash(path):
+                sheets = content['sheets']
+            else:
+                _logger.debug('{} is outdated, reading {} instead'.format(sidecar, path))
+        except Exception as e:
+            _logger.debug('{} cannot be read ({}), reading {} instead'.format(sidecar, e, path))
+
+    _sidecars[path] = (signature, sheets)
+    return sheets
+
+
+def _parse_sheet(path, signature, sheet_name, index_col):
+    """Parse a sheet from the sidecar when valid, from the workbook otherwise."""
+    sheets = _get_sidecar_sheets(os.path.abspath(path), signature)
+    if sheets is not None and sheet_name in sheets:
+        df = sheets[sheet_name]
+        if index_col is not None:
+            df = df.set_index(index_col)
+        return df, 'sidecar'
+
+    return pd.read_excel(path, sheet_name=sheet_name, index_col=index_col), 'excel'
+
+
+def read_sheet(path, sheet_name, index_col=None):
+    """Return one sheet of an Excel workbook as a DataFrame.
+    The sheet is parsed once per process and kept in memory. It is parsed
+    again only if the modification time or the size of the file changed.
+    Parameters
+    ----------
+    path: str
+        path to the workbook (eg. 'config.xlsx')
+    sheet_name: str
+        name of the sheet to read
+    index_col: str
+        optional column to use as index
+    Returns : copy of the parsed sheet (pd.DataFrame)
+    """
+    key = (os.path.abspath(path), sheet_name, index_col)
+    signature = _file_signature(path)
+
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None or entry[0] != signature:
+            start = time.perf_counter()
+            df, source = _parse_sheet(path, signature, sheet_name, index_col)
+            elapsed = time.perf_counter() - start
+
+            _cache[key] = (signature, df)
+            _load_timings.append({'path': path, 'sheet': sheet_name, 'source': source,
+                                  'rows': len(df), 'seconds': elapsed})
+            _logger.debug('{} [{}] loaded from {} in {:.3f}s'.format(path, sheet_name, source, elapsed))
+        else:
+            df = entry[1]
+
+    return df.copy()
+
+
+def get_load_timings():
+    """Return the list of sheets parsed so far, with their source ('excel' or
+    'sidecar') and their load time (in seconds)."""
+    with _lock:
+        return [dict(t) for t in _load_timings]
+
+
+def get_total_load_time():
+    """Return the total time spent (in seconds) parsing workbooks in this process."""
+    with _lock:
+        return sum(t['seconds'] for t in _load_timings)
+
+
+def clear_cache():
+    """Forget every parsed sheet. Next reads will parse the files again."""
+    with _lock:
+        _cache.clear()
+        _sidecars.clear()
+
+
+def compile_sidecar(path):
+    """Parse every sheet of the workbook `path` and store them, along with the
+    content hash of the workbook, in a binary sidecar next to it.
+    Returns : path of the sidecar written
+    """
+    content = {'hash': _content_hash(path),
+               'sheets': pd.read_excel(path, sheet_name=None)}
+
+    sidecar = _sidecar_path(path)
+    with open(sidecar, 'wb') as f:
+        pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    with _lock:
+        _sidecars.pop(os.path.abspath(path), None)
+
+    return sidecar
+
+
+if __name__ == '__main__':
+    for p in sys.argv[1:] or ['config.xlsx', 'mapping.xlsx']:
+        print('{} -> {}'.format(p, compile_sidecar(p)))